@@ -3,14 +3,47 @@
 from .scraper import Scraper
 from .cli import CLI
 from .db import Database
+from .replay import Recorder, ReplayServer
 
 
 def main():
     cli = CLI()
+    if cli.args.serve is not None:
+        cli.serve()
+        return
+    db = Database(cli.args.database, log_level=cli.log_level,
+                  compress=cli.args.compress or cli.args.compress_existing)
+    if cli.args.compress_existing:
+        db.compress_texts()
+        return
+    if cli.args.overlap:
+        cli.overlap(db)
+        return
+
+    recorder = None
+    replay = None
+    host = None
+    if cli.args.record is not None:
+        recorder = Recorder(cli.args.record, log_level=cli.log_level)
+    if cli.args.replay is not None:
+        replay = ReplayServer(cli.args.replay,
+                              latency=cli.args.replay_latency,
+                              log_level=cli.log_level)
+        replay.start()
+        host = replay.url
     scraper = Scraper(log_level=cli.log_level,
-                      throttle_delay=cli.args.rate_limit)
-    db = Database(cli.args.database, log_level=cli.log_level)
-    cli.main(scraper, db)
+                      throttle_delay=cli.args.rate_limit,
+                      recycle_pages=cli.args.recycle_pages,
+                      max_memory=cli.args.max_memory,
+                      max_latency=cli.args.max_latency,
+                      host=host, recorder=recorder)
+    try:
+        cli.main(scraper, db)
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if replay is not None:
+            replay.shutdown()
 
 
 if __name__ == "__main__":
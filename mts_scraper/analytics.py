@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Cross-program module overlap analytics."""
+
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class ModuleOverlap:
+    """Program x module incidence matrix and overlap measures on it.
+
+    Row i of the incidence matrix belongs to program programs[i],
+    column j to module modules[j] (an (ID, version) pair).
+    """
+
+    def __init__(self, programs, modules, incidence, generation=None):
+        """Create the overlap from an incidence matrix.
+
+        programs -- Array of program IDs
+        modules -- Array of (module ID, module version) rows
+        incidence -- Boolean matrix, True if a module is in a program
+        generation -- Generation of the database the incidence was
+                      loaded from
+        """
+        self._logger = logging.getLogger(__name__ + ".ModuleOverlap")
+        self.programs = programs
+        self.modules = modules
+        self.incidence = incidence
+        self.generation = generation
+        self._program_index = {int(p): i for i, p in enumerate(programs)}
+        self._intersections = None
+
+    @classmethod
+    def from_database(cls, db, cache_file=None):
+        """Load the incidence matrix from the database in one pass.
+
+        cache_file -- If given, the matrix is cached in this file and
+                      only loaded from the database if the database
+                      changed since (see Database.generation()) or the
+                      file belongs to another database (see
+                      Database.uuid()).
+        """
+        if np is None:
+            raise RuntimeError("Overlap analytics require numpy")
+
+        db_uuid = db.uuid()
+        generation = db.generation()
+        if cache_file is not None and os.path.exists(cache_file):
+            with np.load(cache_file) as cached:
+                if "uuid" in cached and cached["uuid"] == db_uuid and \
+                   cached["generation"] == generation:
+                    incidence = np.unpackbits(
+                        cached["incidence"], axis=1,
+                        count=len(cached["modules"])
+                    ).astype(bool)
+                    return cls(cached["programs"], cached["modules"],
+                               incidence, generation)
+
+        rows = np.array(db.get_program_modules_incidence(), dtype=np.int64)
+        rows = rows.reshape(-1, 3)
+        programs, program_idx = np.unique(rows[:, 0], return_inverse=True)
+        modules, module_idx = np.unique(rows[:, 1:], axis=0,
+                                        return_inverse=True)
+        incidence = np.zeros((len(programs), len(modules)), dtype=bool)
+        incidence[program_idx, module_idx.reshape(-1)] = True
+
+        if cache_file is not None:
+            with open(cache_file, "wb") as f:
+                np.savez_compressed(
+                    f, uuid=db_uuid, generation=generation,
+                    programs=programs,
+                    modules=modules,
+                    incidence=np.packbits(incidence, axis=1)
+                )
+        return cls(programs, modules, incidence, generation)
+
+    def _index(self, program_id):
+        """Get the row of a program in the incidence matrix."""
+        try:
+            return self._program_index[int(program_id)]
+        except (KeyError, ValueError):
+            raise KeyError(f"Program {program_id} has no modules") from None
+
+    def module_counts(self):
+        """Get the number of modules in each program."""
+        return self.incidence.sum(axis=1)
+
+    def intersections(self):
+        """Get the number of modules shared by each pair of programs.
+
+        Returns a symmetric programs x programs matrix. The diagonal
+        contains the number of modules in each program.
+        """
+        if self._intersections is None:
+            # float32 matrix products use BLAS and are exact for counts
+            # below 2**24
+            a = self.incidence.astype(np.float32)
+            self._intersections = (a @ a.T).astype(np.int64)
+        return self._intersections
+
+    def jaccard(self):
+        """Get the Jaccard similarity of each pair of programs."""
+        shared = self.intersections()
+        counts = np.diag(shared)
+        union = counts[:, None] + counts[None, :] - shared
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(union > 0, shared / union, 0.0)
+
+    def unique_modules(self, program_id):
+        """Get the modules that are in no other program than this one.
+
+        Returns an array of (module ID, module version) rows.
+        """
+        row = self.incidence[self._index(program_id)]
+        unique = row & (self.incidence.sum(axis=0) == 1)
+        return self.modules[unique]
+
+    def top_pairs(self, limit=None, program_id=None):
+        """Get the program pairs with the highest Jaccard similarity.
+
+        limit -- Maximum number of pairs, or None for all pairs with
+                 shared modules
+        program_id -- Only get pairs containing this program
+
+        Returns a list of (program ID, program ID, shared modules,
+        Jaccard similarity) tuples.
+        """
+        shared = self.intersections()
+        jaccard = self.jaccard()
+        if program_id is None:
+            i, j = np.triu_indices(len(self.programs), k=1)
+        else:
+            j = np.arange(len(self.programs))
+            j = j[j != self._index(program_id)]
+            i = np.full_like(j, self._index(program_id))
+        keep = shared[i, j] > 0
+        i, j = i[keep], j[keep]
+        order = np.argsort(-jaccard[i, j], kind="stable")[:limit]
+        return [
+            (int(self.programs[a]), int(self.programs[b]), int(shared[a, b]),
+             float(jaccard[a, b]))
+            for a, b in zip(i[order], j[order])
+        ]
@@ -5,6 +5,10 @@ import argparse
 import sys
 import logging
 import itertools
+import time
+
+from .analytics import ModuleOverlap
+from .server import QueryServer
 
 
 class CLI:
@@ -36,6 +40,75 @@ class CLI:
                             help="""Force a refetch of study areas/module
                             lists, even if they are already stored in the
                             database.""")
+        parser.add_argument("-R", "--refresh-details", action="store_true",
+                            help="""Fetch the details of all modules in the
+                            program again, not only the unfetched ones.
+                            Changes are recorded in the module history.""")
+        parser.add_argument("--max-retries", default=3, type=int,
+                            metavar="N",
+                            help="""How often to retry fetching the details of
+                            a module after it failed""")
+        parser.add_argument("--retry-delay", default=60.0, type=float,
+                            metavar="SECONDS",
+                            help="""Delay before retrying a failed module. The
+                            delay is doubled for every failed retry.""")
+        parser.add_argument("--reset-failures", action="store_true",
+                            help="""Retry the failed modules of the program
+                            again, including those that ran out of
+                            retries""")
+        parser.add_argument("--recycle-pages", default=500, type=int,
+                            metavar="N",
+                            help="""Restart the browser after loading this
+                            many pages (0 to disable)""")
+        parser.add_argument("--max-memory", default=2000, type=int,
+                            metavar="MB",
+                            help="""Restart the browser if it uses more memory
+                            than this (0 to disable, requires psutil)""")
+        parser.add_argument("--max-latency", default=20.0, type=float,
+                            metavar="SECONDS",
+                            help="""Restart the browser if the median page load
+                            takes longer than this (0 to disable)""")
+        parser.add_argument("--pipeline", action="store_true",
+                            help="""Parse module pages in a worker thread while
+                            loading the next one (requires lxml)""")
+        parser.add_argument("--prefetch", action="store_true",
+                            help="""With --pipeline, load the next module page
+                            in a second tab while waiting for the current
+                            one""")
+        parser.add_argument("-t", "--tabs", default=1, type=int,
+                            metavar="N",
+                            help="""Number of browser tabs to fetch the module
+                            lists of study areas with. The rate limit is
+                            shared between all tabs, so this only helps if
+                            loading a module list takes longer than it.""")
+        parser.add_argument("-z", "--compress", action="store_true",
+                            help="""Store learning outcomes and content
+                            zstd-compressed (requires zstandard).""")
+        parser.add_argument("--compress-existing", action="store_true",
+                            help="""Train a compression dictionary from the
+                            database, compress all texts already stored with
+                            it and exit.""")
+        parser.add_argument("--overlap", action="store_true",
+                            help="""Print the pairs of programs in the database
+                            sharing the most modules (or, with -p, the
+                            programs sharing the most modules with that
+                            program) and exit (requires numpy).""")
+        parser.add_argument("--top", default=20, type=int, metavar="N",
+                            help="Number of pairs to print with --overlap")
+        parser.add_argument("--serve", metavar="[HOST:]PORT",
+                            help="""Serve the database read-only over HTTP/JSON
+                            instead of scraping. This can run while another
+                            process is scraping into the database.""")
+        parser.add_argument("--record", metavar="ARCHIVE",
+                            help="""Record all responses the browser receives
+                            into this archive (gzipped JSON lines)""")
+        parser.add_argument("--replay", metavar="ARCHIVE",
+                            help="""Scrape from a local server replaying the
+                            responses recorded with --record instead of
+                            MTS""")
+        parser.add_argument("--replay-latency", action="store_true",
+                            help="""With --replay, delay each response by its
+                            recorded latency""")
         parser.add_argument("-v", "--verbosity", default="INFO",
                             choices=["DEBUG", "INFO", "WARN", "ERROR",
                                      "CRITICAL"])
@@ -61,6 +134,26 @@ class CLI:
             self._logger.warning(
                 "Only one of -p and -n can be specified!")
             sys.exit(1)
+        if self.args.prefetch and not self.args.pipeline:
+            self._logger.warning("--prefetch requires --pipeline!")
+            sys.exit(1)
+        if self.args.serve is not None and \
+           not self.args.serve.rpartition(":")[2].isdigit():
+            self._logger.warning("--serve requires a port!")
+            sys.exit(1)
+        if self.args.record is not None and self.args.replay is not None:
+            self._logger.warning(
+                "Only one of --record and --replay can be specified!")
+            sys.exit(1)
+        if self.args.record is not None and \
+           (self.args.tabs > 1 or self.args.prefetch):
+            # Only responses in the current tab can be recorded
+            self._logger.warning(
+                "--record requires a single tab (no -t or --prefetch)!")
+            sys.exit(1)
+        if self.args.tabs < 1:
+            self._logger.warning("-t must be at least 1!")
+            sys.exit(1)
 
     def _ask_for_program_id(self):
         """Figure out what program ID we should scrape.
@@ -112,27 +205,111 @@ class CLI:
         for a in area.subareas:
             self._print_area(a, level + 1)
 
+    def serve(self):
+        """Serve the database over HTTP until interrupted."""
+        host, _, port = self.args.serve.rpartition(":")
+        try:
+            server = QueryServer(self.args.database, host or "127.0.0.1",
+                                 int(port), log_level=self.log_level)
+        except (FileNotFoundError, RuntimeError) as e:
+            self._logger.warning("%s!", e)
+            sys.exit(1)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
+
+    def overlap(self, db):
+        """Print the module overlap between programs."""
+        overlap = ModuleOverlap.from_database(
+            db, cache_file=self.args.database + ".overlap.npz")
+        titles = {id: f"{title} ({degree})"
+                  for id, title, degree in db.get_programs()}
+        try:
+            pairs = overlap.top_pairs(self.args.top, self.args.program_id)
+            if self.args.program_id is not None:
+                unique = overlap.unique_modules(self.args.program_id)
+        except KeyError as e:
+            # The program is not in the DB or has no modules
+            self._logger.warning("%s!", e.args[0])
+            sys.exit(1)
+
+        print("Shared\tJaccard\tProgram\tProgram")
+        for a, b, shared, jaccard in pairs:
+            print(f"{shared}\t{jaccard:.3f}\t{titles.get(a, a)}\t"
+                  f"{titles.get(b, b)}")
+        if self.args.program_id is not None:
+            print(f"{len(unique)} modules are only in "
+                  f"{titles.get(int(self.args.program_id))}")
+
     def _fetch_areas_and_modules(self):
+        """Fetch and save the study areas and their module lists.
+
+        Each module list is committed as soon as it has been fetched.
+        If the study areas of the program were saved by a previous
+        session, the module lists saved already are skipped.
+        """
         areas = self._scraper.get_areas()
-        modules = set()
-        for area in areas:
-            area.fetch_modules(self._scraper)
-            area_modules = itertools.chain.from_iterable(
-                (a.modules for a in area.flatten())
-            )
-            for m in area_modules:
-                modules.add(m)
+        all_areas = list(itertools.chain.from_iterable(
+            (a.flatten() for a in areas)
+        ))
+        if not self._resume_areas(all_areas):
+            for area in areas:
+                self._db.save_area(area, self.args.program_id)
+
+        known_modules = set(self._db.get_modules(True))
+        new_modules = 0
+        unfetched = [a for a in all_areas if not a.modules_fetched]
+        for area in self._scraper.fetch_area_modules(unfetched,
+                                                     self.args.tabs):
+            new = [m for m in set(area.modules) if m not in known_modules]
+            self._db.save_area_modules(area, new)
+            known_modules.update(new)
+            new_modules += len(new)
 
         print("Areas:")
         for area in areas:
             self._print_area(area)
-            self._db.save_area(area, self.args.program_id)
-        found_modules = len(modules)
-        modules -= set(self._db.get_modules(True))
         self._logger.info("Found %d new modules in this program.",
-                          len(modules))
-        for module in modules:
-            self._db.save_module(module)
+                          new_modules)
+
+    def _resume_areas(self, areas):
+        """Match the areas with the ones saved by a previous session.
+
+        areas -- All areas of the program, in pre-order
+
+        Sets db_id and modules_fetched of the areas, and the modules of
+        the areas whose module lists were saved already. If the saved
+        areas don't match the areas (i.e. the program changed), they are
+        deleted.
+
+        Returns True if the saved areas could be used.
+        """
+        saved = self._db.get_areas(self.args.program_id)
+        if not saved:
+            return False
+
+        def matches(area, saved_area):
+            _, title, parent_position, _ = saved_area
+            parent = None if area.parent is None else area.parent.index
+            return title == area.title and parent_position == parent
+
+        if len(saved) != len(areas) or \
+           not all(map(matches, areas, saved)):
+            self._logger.warning(
+                "Study areas changed since the previous session, fetching "
+                "all module lists again.")
+            self._db.delete_areas(self.args.program_id)
+            return False
+
+        for area, (db_id, _, _, fetched) in zip(areas, saved):
+            area.db_id = db_id
+            area.modules_fetched = fetched
+            if fetched:
+                area.modules = self._db.get_area_modules(db_id)
+        self._logger.info("Resuming, %d of %d module lists already fetched.",
+                          sum(a.modules_fetched for a in areas), len(areas))
+        return True
 
     def main(self, scraper, db):
         """Execute whatever was specified on the command line.
@@ -153,21 +330,106 @@ class CLI:
 
         self._logger.info(f"Scraping program with ID {self.args.program_id}")
 
-        if self._db.program_exists(self.args.program_id):
+        if self._db.program_complete(self.args.program_id):
             self._logger.info(
                 "Program already exists in DB, continuing previous session.")
-            title, degree = self._db.get_program_info(self.args.program_id)
         else:
             self._logger.info(
-                "Program does not exist in DB, fetching study areas/modules.")
+                "Program is not complete in DB, fetching study "
+                "areas/modules.")
             self._scraper.load_program(self.args.program_id)
-            title, degree = self._scraper.get_program_info()
+            if not self._db.program_exists(self.args.program_id):
+                title, degree = self._scraper.get_program_info()
+                self._db.save_program(self.args.program_id, title, degree)
             self._fetch_areas_and_modules()
-            self._db.save_program(self.args.program_id, title, degree)
-
-        for module in self._db.unfetched_modules(self.args.program_id):
-            self._logger.info("Fetching details for `%s' (ID=%d, V=%d)",
-                              module.title, module.id, module.version)
-            details, parts = self._scraper.get_module_details(
-                module.id, module.version)
-            self._db.save_module_details(module, details, parts)
+            self._db.set_program_complete(self.args.program_id)
+            self._db.refresh_area_stats(self.args.program_id)
+
+        if self.args.reset_failures:
+            reset = self._db.reset_failures(self.args.program_id)
+            self._logger.info("Reset the retries of %d failed modules.",
+                              reset)
+        if self.args.refresh_details:
+            modules = self._db.program_modules(self.args.program_id)
+        else:
+            modules = self._db.unfetched_modules(self.args.program_id)
+        if self.args.pipeline:
+            fetched = self._scraper.iter_module_details(modules,
+                                                        self.args.prefetch)
+            for module, future in fetched:
+                self._logger.info("Fetched details for `%s' (ID=%d, V=%d)",
+                                  module.title, module.id, module.version)
+                self._save_module_details(module, future.result)
+        else:
+            for module in modules:
+                self._fetch_module_details(module)
+        self._retry_failed_modules()
+        self._db.refresh_area_stats(self.args.program_id)
+        self._log_quarantined_modules()
+
+    def _fetch_module_details(self, module):
+        """Fetch and save the details of a module."""
+        self._logger.info("Fetching details for `%s' (ID=%d, V=%d)",
+                          module.title, module.id, module.version)
+        self._save_module_details(
+            module,
+            lambda: self._scraper.get_module_details(module.id,
+                                                     module.version)
+        )
+
+    def _save_module_details(self, module, get_details):
+        """Save the details of a module.
+
+        get_details -- Function returning the details and parts of the
+                       module
+
+        If get_details raises an exception, the module is saved to the
+        failures table instead of aborting.
+        """
+        try:
+            details, parts = get_details()
+        except Exception as e:
+            kind = self._scraper.classify_error(e)
+            retries = self._db.save_failure(module, kind, repr(e),
+                                            self.args.retry_delay)
+            self._logger.warning(
+                "Fetching details for `%s' (ID=%d, V=%d) failed (%s, %d "
+                "retries so far): %r", module.title, module.id,
+                module.version, kind, retries, e)
+            return
+        self._db.save_module_details(module, details, parts)
+        self._db.clear_failure(module)
+
+    def _log_quarantined_modules(self):
+        """Log the modules that ran out of retries."""
+        quarantined = self._db.quarantined_modules(self.args.program_id,
+                                                   self.args.max_retries)
+        if not quarantined:
+            return
+        self._logger.warning(
+            "%d modules ran out of retries and are skipped until "
+            "--reset-failures is given:", len(quarantined))
+        for module, kind in quarantined:
+            self._logger.warning("`%s' (ID=%d, V=%d): %s", module.title,
+                                 module.id, module.version, kind)
+
+    def _retry_failed_modules(self):
+        """Retry failed modules until they succeed or hit --max-retries.
+
+        Waits for the next attempt of each module to be due.
+        """
+        while True:
+            failed = self._db.failed_modules(self.args.program_id,
+                                             self.args.max_retries)
+            if not failed:
+                return
+            wait = failed[0][1] - time.time()
+            if wait > 0:
+                self._logger.info(
+                    "%d failed modules left, waiting %.0f seconds for the "
+                    "next retry", len(failed), wait)
+                time.sleep(wait)
+            for module, next_attempt in failed:
+                if next_attempt > time.time():
+                    break
+                self._fetch_module_details(module)
@@ -1,24 +1,95 @@
 #!/usr/bin/env python3
 
+import datetime
+import json
 import logging
+import pathlib
 import sqlite3
+import time
+import uuid
 
-from .scraper import Module
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from . import history
+from .scraper import Module, ModulePart
 
 
 class Database:
     """Database connection."""
 
-    def __init__(self, db_file, log_level=logging.INFO):
+    # Lookup tables for strings that many modules/parts share
+    LOOKUP_TABLES = ("exam_types", "faculties", "departments", "languages",
+                     "part_types", "turnuses")
+
+    # Tables and views of the current schema. Read-only connections
+    # can't create or migrate them, so they check that they all exist.
+    SCHEMA_TABLES = ("programs", "study_areas", "study_area_closure",
+                     "study_area_stats", "modules_base",
+                     "modules_study_areas", "module_parts_base", "db_state",
+                     "compression_dicts", "module_revisions", "failures",
+                     "modules", "module_parts") + LOOKUP_TABLES
+
+    # Maximum number of deltas between two full revisions in the history
+    MAX_DELTA_CHAIN = 16
+
+    # Text is written once per module, so we can afford a slow level
+    COMPRESSION_LEVEL = 19
+    COMPRESSION_DICT_SIZE = 112640
+
+    def __init__(self, db_file, log_level=logging.INFO, compress=False,
+                 read_only=False):
         """Create the database connection.
 
         If the tables do not yet exist, they are created.
+
+        If compress is True, the learning outcomes and content of
+        modules are stored zstd-compressed (using the most recently
+        trained dictionary, see compress_texts()). Compressed values
+        are always decompressed on read, regardless of compress.
+
+        If read_only is True, the database must exist already and have
+        the current schema (i.e. it must have been opened for writing by
+        this version once). Nothing is written to it, and the
+        connection may be used from other threads (but not at the same
+        time).
         """
         logging.getLogger(__name__).setLevel(log_level)
         self._logger = logging.getLogger(__name__ + ".Database")
 
-        self._con = sqlite3.connect(db_file)
-        self._create_tables()
+        if compress and zstandard is None:
+            raise RuntimeError("Compression requires the zstandard package")
+        self._compress = compress
+
+        self._lookup_cache = {table: {} for table in self.LOOKUP_TABLES}
+        if read_only:
+            uri = pathlib.Path(db_file).resolve().as_uri()
+            self._con = sqlite3.connect(uri + "?mode=ro", uri=True,
+                                        check_same_thread=False)
+            try:
+                self._check_schema(db_file)
+            except sqlite3.OperationalError as e:
+                # Reading a WAL database needs its -shm file, which
+                # can't be created if the directory is read-only, too
+                self._logger.warning(
+                    "Opening %s as immutable (%s), changes made by other "
+                    "processes will not be seen", db_file, e)
+                self._con.close()
+                self._con = sqlite3.connect(uri + "?immutable=1", uri=True,
+                                            check_same_thread=False)
+                self._check_schema(db_file)
+        else:
+            self._con = sqlite3.connect(db_file)
+            # Readers don't block the writer (and vice versa) in WAL
+            # mode
+            self._con.execute("PRAGMA journal_mode = WAL;")
+            self._create_tables()
+        self._load_compression_dicts()
+        if not read_only:
+            # Needs the views and the dictionaries to read the history
+            self._migrate_to_reverse_deltas()
 
     def __del__(self):
         self._con.close()
@@ -30,7 +101,8 @@ class Database:
                 """CREATE TABLE IF NOT EXISTS programs (
                   id INTEGER PRIMARY KEY,
                   title TEXT NOT NULL,
-                  degree TEXT NOT NULL
+                  degree TEXT NOT NULL,
+                  areas_complete BOOLEAN DEFAULT FALSE
                 );"""
             )
             self._con.execute(
@@ -39,6 +111,8 @@ class Database:
                   title TEXT NOT NULL,
                   parent_id INTEGER,
                   program_id INTEGER NOT NULL,
+                  position INTEGER,
+                  modules_fetched BOOLEAN DEFAULT FALSE,
                   FOREIGN KEY (program_id)
                     REFERENCES programs (id)
                     ON UPDATE NO ACTION
@@ -46,20 +120,70 @@ class Database:
                 );"""
             )
             self._con.execute(
-                """CREATE TABLE IF NOT EXISTS modules (
+                """CREATE TABLE IF NOT EXISTS study_area_closure (
+                  ancestor_id INTEGER,
+                  descendant_id INTEGER,
+                  depth INTEGER NOT NULL,
+                  PRIMARY KEY (ancestor_id, descendant_id),
+                  FOREIGN KEY (ancestor_id)
+                    REFERENCES study_areas (id)
+                    ON UPDATE NO ACTION
+                    ON DELETE CASCADE,
+                  FOREIGN KEY (descendant_id)
+                    REFERENCES study_areas (id)
+                    ON UPDATE NO ACTION
+                    ON DELETE CASCADE
+                );"""
+            )
+            self._con.execute(
+                """CREATE INDEX IF NOT EXISTS study_area_closure_descendant
+                ON study_area_closure (descendant_id);"""
+            )
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS study_area_stats (
+                  area_id INTEGER PRIMARY KEY,
+                  module_count INTEGER NOT NULL,
+                  ects_sum INTEGER NOT NULL,
+                  sws_sum INTEGER NOT NULL,
+                  FOREIGN KEY (area_id)
+                    REFERENCES study_areas (id)
+                    ON UPDATE NO ACTION
+                    ON DELETE CASCADE
+                );"""
+            )
+            for table in self.LOOKUP_TABLES:
+                self._con.execute(
+                    f"""CREATE TABLE IF NOT EXISTS {table} (
+                      id INTEGER PRIMARY KEY,
+                      name TEXT UNIQUE NOT NULL
+                    );"""
+                )
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS modules_base (
                   id INTEGER,
                   version INTEGER,
                   title TEXT NOT NULL,
                   ects INTEGER NOT NULL,
-                  exam_type TEXT NOT NULL,
+                  exam_type_id INTEGER NOT NULL,
                   details_fetched BOOLEAN DEFAULT FALSE,
-                  faculty TEXT,
-                  department TEXT,
+                  faculty_id INTEGER,
+                  department_id INTEGER,
                   learning_outcomes TEXT,
                   content TEXT,
-                  PRIMARY KEY (id, version)
+                  PRIMARY KEY (id, version),
+                  FOREIGN KEY (exam_type_id) REFERENCES exam_types (id),
+                  FOREIGN KEY (faculty_id) REFERENCES faculties (id),
+                  FOREIGN KEY (department_id) REFERENCES departments (id)
                 );"""
             )
+            self._con.execute(
+                """CREATE INDEX IF NOT EXISTS modules_base_faculty
+                ON modules_base (faculty_id);"""
+            )
+            self._con.execute(
+                """CREATE INDEX IF NOT EXISTS modules_base_department
+                ON modules_base (department_id);"""
+            )
             self._con.execute(
                 """CREATE TABLE IF NOT EXISTS modules_study_areas (
                   study_area_id INTEGER,
@@ -71,29 +195,498 @@ class Database:
                     ON UPDATE NO ACTION
                     ON DELETE CASCADE,
                   FOREIGN KEY (module_id, module_version)
-                    REFERENCES modules (id, version)
+                    REFERENCES modules_base (id, version)
                     ON UPDATE NO ACTION
                     ON DELETE CASCADE
                 );"""
             )
             self._con.execute(
-                """CREATE TABLE IF NOT EXISTS module_parts (
+                """CREATE TABLE IF NOT EXISTS module_parts_base (
                   id INTEGER PRIMARY KEY AUTOINCREMENT,
                   title TEXT NOT NULL,
-                  language TEXT NOT NULL,
-                  type TEXT NOT NULL,
-                  turnus TEXT NOT NULL,
+                  language_id INTEGER NOT NULL,
+                  type_id INTEGER NOT NULL,
+                  turnus_id INTEGER NOT NULL,
                   sws INTEGER NOT NULL,
                   number TEXT,
                   module_id INTEGER NOT NULL,
                   module_version INTEGER NOT NULL,
+                  FOREIGN KEY (language_id) REFERENCES languages (id),
+                  FOREIGN KEY (type_id) REFERENCES part_types (id),
+                  FOREIGN KEY (turnus_id) REFERENCES turnuses (id),
+                  FOREIGN KEY (module_id, module_version)
+                    REFERENCES modules_base (id, version)
+                    ON UPDATE NO ACTION
+                    ON DELETE CASCADE
+                );"""
+            )
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS db_state (
+                  id INTEGER PRIMARY KEY CHECK (id = 0),
+                  generation INTEGER NOT NULL,
+                  uuid TEXT
+                );"""
+            )
+            self._con.execute(
+                """INSERT OR IGNORE INTO db_state (id, generation)
+                VALUES (0, 0);"""
+            )
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS compression_dicts (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  dict_id INTEGER UNIQUE NOT NULL,
+                  data BLOB NOT NULL
+                );"""
+            )
+
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS module_revisions (
+                  id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  module_id INTEGER NOT NULL,
+                  module_version INTEGER NOT NULL,
+                  observed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                  kind TEXT NOT NULL,
+                  base_id INTEGER,
+                  digest TEXT NOT NULL,
+                  data TEXT,
+                  FOREIGN KEY (module_id, module_version)
+                    REFERENCES modules_base (id, version)
+                    ON UPDATE NO ACTION
+                    ON DELETE CASCADE,
+                  FOREIGN KEY (base_id) REFERENCES module_revisions (id)
+                );"""
+            )
+            self._con.execute(
+                """CREATE INDEX IF NOT EXISTS module_revisions_module
+                ON module_revisions (
+                  module_id, module_version, observed_at
+                );"""
+            )
+            self._con.execute(
+                """CREATE INDEX IF NOT EXISTS module_revisions_changes
+                ON module_revisions (observed_at) WHERE kind != 'same';"""
+            )
+
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS failures (
+                  module_id INTEGER,
+                  module_version INTEGER,
+                  kind TEXT NOT NULL,
+                  message TEXT,
+                  retries INTEGER NOT NULL DEFAULT 0,
+                  next_attempt REAL NOT NULL,
+                  PRIMARY KEY (module_id, module_version),
                   FOREIGN KEY (module_id, module_version)
-                    REFERENCES modules (id, version)
+                    REFERENCES modules_base (id, version)
                     ON UPDATE NO ACTION
                     ON DELETE CASCADE
                 );"""
             )
 
+        self._migrate_to_lookup_tables()
+        self._migrate_to_resumable_areas()
+        self._migrate_to_area_closure()
+        self._migrate_to_db_uuid()
+
+        # Compatibility views with the column shape of the tables that
+        # stored the strings directly
+        with self._con:
+            self._con.execute(
+                """CREATE VIEW IF NOT EXISTS modules AS
+                SELECT M.id, M.version, M.title, M.ects,
+                  E.name AS exam_type, M.details_fetched,
+                  F.name AS faculty, D.name AS department,
+                  M.learning_outcomes, M.content
+                FROM modules_base M
+                INNER JOIN exam_types E ON E.id = M.exam_type_id
+                LEFT JOIN faculties F ON F.id = M.faculty_id
+                LEFT JOIN departments D ON D.id = M.department_id;"""
+            )
+            self._con.execute(
+                """CREATE VIEW IF NOT EXISTS module_parts AS
+                SELECT P.id, P.title, L.name AS language, T.name AS type,
+                  U.name AS turnus, P.sws, P.number, P.module_id,
+                  P.module_version
+                FROM module_parts_base P
+                INNER JOIN languages L ON L.id = P.language_id
+                INNER JOIN part_types T ON T.id = P.type_id
+                INNER JOIN turnuses U ON U.id = P.turnus_id;"""
+            )
+
+    def _check_schema(self, db_file):
+        """Check that all tables of the current schema exist.
+
+        Raises a RuntimeError naming the missing tables otherwise.
+        """
+        existing = {row[0] for row in self._con.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view');")}
+        missing = [t for t in self.SCHEMA_TABLES if t not in existing]
+        if missing:
+            raise RuntimeError(
+                f"Database {db_file} lacks the tables {', '.join(missing)}. "
+                "Run a scrape on it first to create or migrate them")
+
+    def _migrate_to_lookup_tables(self):
+        """Migrate modules/module_parts from databases with strings.
+
+        Databases created before the lookup tables were introduced have
+        modules and module_parts tables with the strings stored
+        directly. Their rows are moved to the base tables and the old
+        tables are dropped, so the views can take their place.
+
+        The foreign keys of modules_study_areas still reference the
+        modules table afterwards. This is harmless, since foreign keys
+        are not enforced.
+        """
+        row = self._con.execute(
+            "SELECT type FROM sqlite_master WHERE name = 'modules';"
+        ).fetchone()
+        if row is None or row[0] != "table":
+            return
+
+        self._logger.info("Migrating database to lookup tables")
+        columns = (
+            ("exam_types", "modules", "exam_type"),
+            ("faculties", "modules", "faculty"),
+            ("departments", "modules", "department"),
+            ("languages", "module_parts", "language"),
+            ("part_types", "module_parts", "type"),
+            ("turnuses", "module_parts", "turnus"),
+        )
+        with self._con:
+            for lookup, table, column in columns:
+                self._con.execute(
+                    f"""INSERT OR IGNORE INTO {lookup} (name)
+                    SELECT DISTINCT {column} FROM {table}
+                    WHERE {column} IS NOT NULL;"""
+                )
+            self._con.execute(
+                """\
+                INSERT INTO modules_base
+                SELECT M.id, M.version, M.title, M.ects, E.id,
+                  M.details_fetched, F.id, D.id, M.learning_outcomes,
+                  M.content
+                FROM modules M
+                INNER JOIN exam_types E ON E.name = M.exam_type
+                LEFT JOIN faculties F ON F.name = M.faculty
+                LEFT JOIN departments D ON D.name = M.department;"""
+            )
+            self._con.execute(
+                """\
+                INSERT INTO module_parts_base
+                SELECT P.id, P.title, L.id, T.id, U.id, P.sws, P.number,
+                  P.module_id, P.module_version
+                FROM module_parts P
+                INNER JOIN languages L ON L.name = P.language
+                INNER JOIN part_types T ON T.name = P.type
+                INNER JOIN turnuses U ON U.name = P.turnus;"""
+            )
+            self._con.execute("DROP TABLE module_parts;")
+            self._con.execute("DROP TABLE modules;")
+
+    def _migrate_to_resumable_areas(self):
+        """Add the columns for resuming the area phase to old databases.
+
+        Before, programs and study areas were only saved once all module
+        lists had been fetched, so existing ones are complete.
+        """
+        columns = [row[1] for row in
+                   self._con.execute("PRAGMA table_info(programs);")]
+        if "areas_complete" in columns:
+            return
+
+        self._logger.info("Migrating database to resumable areas")
+        with self._con:
+            self._con.execute(
+                """ALTER TABLE programs
+                ADD COLUMN areas_complete BOOLEAN DEFAULT FALSE;"""
+            )
+            self._con.execute(
+                "ALTER TABLE study_areas ADD COLUMN position INTEGER;")
+            self._con.execute(
+                """ALTER TABLE study_areas
+                ADD COLUMN modules_fetched BOOLEAN DEFAULT FALSE;"""
+            )
+            self._con.execute("UPDATE programs SET areas_complete = TRUE;")
+            self._con.execute("UPDATE study_areas SET modules_fetched = TRUE;")
+
+    def _migrate_to_area_closure(self):
+        """Fill the closure table for areas saved before it existed."""
+        row = self._con.execute(
+            """\
+            SELECT 1 FROM study_areas A WHERE NOT EXISTS (
+              SELECT 1 FROM study_area_closure C WHERE C.descendant_id = A.id
+            ) LIMIT 1;"""
+        ).fetchone()
+        if row is None:
+            return
+
+        self._logger.info("Migrating database to study area closure table")
+        with self._con:
+            self._con.execute(
+                """\
+                INSERT OR IGNORE INTO study_area_closure
+                WITH RECURSIVE closure (ancestor_id, descendant_id, depth) AS (
+                  SELECT id, id, 0 FROM study_areas
+                  UNION ALL
+                  SELECT C.ancestor_id, A.id, C.depth + 1
+                  FROM closure C
+                  INNER JOIN study_areas A ON A.parent_id = C.descendant_id
+                )
+                SELECT * FROM closure;"""
+            )
+            program_ids = [row[0] for row in self._con.execute(
+                "SELECT DISTINCT program_id FROM study_areas;")]
+        for program_id in program_ids:
+            self.refresh_area_stats(program_id)
+
+    def _migrate_to_db_uuid(self):
+        """Assign the UUID identifying the database if it has none yet.
+
+        Also adds the column to databases created before it existed.
+        """
+        columns = [row[1] for row in
+                   self._con.execute("PRAGMA table_info(db_state);")]
+        with self._con:
+            if "uuid" not in columns:
+                self._con.execute("ALTER TABLE db_state ADD COLUMN uuid TEXT;")
+            self._con.execute(
+                "UPDATE db_state SET uuid = ? WHERE id = 0 AND uuid IS NULL;",
+                (uuid.uuid4().hex,)
+            )
+
+    def _migrate_to_reverse_deltas(self):
+        """Convert the history of old databases to reverse deltas.
+
+        Before, the first revision of a module stored a full snapshot
+        and each later one a delta to the revision before it. Now the
+        latest revision is the details/parts in modules_base and the
+        older ones are reverse deltas (see _save_revision()).
+        """
+        row = self._con.execute(
+            """\
+            SELECT EXISTS (SELECT 1 FROM module_revisions)
+              AND NOT EXISTS (
+                SELECT 1 FROM module_revisions WHERE kind = 'head'
+              );"""
+        ).fetchone()
+        if not row[0]:
+            return
+
+        self._logger.info("Migrating module history to reverse deltas")
+        modules = self._con.execute(
+            "SELECT DISTINCT module_id, module_version FROM module_revisions;"
+        ).fetchall()
+        with self._con:
+            for module in map(lambda r: Module(*r), modules):
+                rows = self._con.execute(
+                    """\
+                    SELECT id, kind, base_id, data FROM module_revisions
+                    WHERE module_id = ? AND module_version = ?
+                      AND kind != 'same'
+                    ORDER BY id;""",
+                    (module.id, module.version)
+                ).fetchall()
+                snapshots = {}
+                for id, kind, base_id, data in rows:
+                    data = json.loads(self._decompress_text(data))
+                    if kind == "delta":
+                        data = history.apply_delta(snapshots[base_id], data)
+                    snapshots[id] = data
+
+                ids = [r[0] for r in rows]
+                snapshots[ids[-1]] = head = self._head_snapshot(module)
+                self._con.execute(
+                    """\
+                    UPDATE module_revisions
+                    SET kind = 'head', base_id = NULL, digest = ?, data = NULL
+                    WHERE id = ?;""",
+                    (history.digest(head), ids[-1])
+                )
+                chain = 0
+                for id, newer_id in zip(ids, ids[1:]):
+                    if chain == self.MAX_DELTA_CHAIN:
+                        kind, base_id, data = "full", None, snapshots[id]
+                        chain = 0
+                    else:
+                        kind, base_id = "delta", newer_id
+                        data = history.make_delta(snapshots[newer_id],
+                                                  snapshots[id])
+                        chain += 1
+                    self._con.execute(
+                        """\
+                        UPDATE module_revisions
+                        SET kind = ?, base_id = ?, data = ?
+                        WHERE id = ?;""",
+                        (kind, base_id,
+                         self._compress_text(
+                             json.dumps(data, ensure_ascii=False)),
+                         id)
+                    )
+
+    def _lookup_id(self, table, name):
+        """Get the ID of a string in a lookup table, adding it if new.
+
+        The mapping is cached, so this only hits the database for new
+        strings. Those are committed right away, so the cache never
+        contains IDs from rolled back transactions.
+        """
+        if name is None:
+            return None
+        cache = self._lookup_cache[table]
+        if name not in cache:
+            with self._con:
+                self._con.execute(
+                    f"INSERT OR IGNORE INTO {table} (name) VALUES (?);",
+                    (name,)
+                )
+            cache[name] = self._con.execute(
+                f"SELECT id FROM {table} WHERE name = ?;", (name,)
+            ).fetchone()[0]
+        return cache[name]
+
+    def _touch(self):
+        """Increment the generation of the database state.
+
+        Must be called inside the transaction of every method changing
+        programs, study areas or modules, so caches can tell when the
+        database changed (see generation()).
+        """
+        self._con.execute(
+            "UPDATE db_state SET generation = generation + 1 WHERE id = 0;")
+
+    def generation(self):
+        """Get the generation of the database state.
+
+        The generation changes whenever programs, study areas or modules
+        change.
+        """
+        return self._con.execute(
+            "SELECT generation FROM db_state WHERE id = 0;").fetchone()[0]
+
+    def uuid(self):
+        """Get the random UUID identifying the database.
+
+        Unlike the path, it tells apart databases created at the same
+        place, e.g. to key caches together with generation().
+        """
+        return self._con.execute(
+            "SELECT uuid FROM db_state WHERE id = 0;").fetchone()[0]
+
+    def _load_compression_dicts(self):
+        """Set up the (de)compressors for the stored dictionaries.
+
+        The compressor uses the most recently trained dictionary, or no
+        dictionary at all if none has been trained yet.
+        """
+        self._decompressors = {}
+        self._compressor = None
+        self._dict_data = None
+        rows = self._con.execute(
+            "SELECT dict_id, data FROM compression_dicts ORDER BY id;"
+        ).fetchall()
+        if zstandard is None:
+            if rows:
+                self._logger.warning(
+                    "Database contains compressed text, but zstandard is "
+                    "not installed")
+            return
+
+        self._decompressors[0] = zstandard.ZstdDecompressor()
+        for dict_id, data in rows:
+            self._dict_data = zstandard.ZstdCompressionDict(data)
+            self._decompressors[dict_id] = zstandard.ZstdDecompressor(
+                dict_data=self._dict_data)
+        if self._compress:
+            self._compressor = zstandard.ZstdCompressor(
+                level=self.COMPRESSION_LEVEL, dict_data=self._dict_data)
+
+    def _compress_text(self, text):
+        """Compress a text column value if compression is enabled."""
+        if self._compressor is None or text is None:
+            return text
+        return self._compressor.compress(text.encode("utf-8"))
+
+    def _decompress_text(self, value):
+        """Decompress a text column value if it is compressed."""
+        if not isinstance(value, bytes):
+            return value
+        if zstandard is None:
+            raise RuntimeError("Decompression requires the zstandard package")
+        dict_id = zstandard.get_frame_parameters(value).dict_id
+        return self._decompressors[dict_id].decompress(value).decode("utf-8")
+
+    def compress_texts(self):
+        """Compress the text columns of all modules already stored.
+
+        A new dictionary is trained from the stored texts first. Then
+        all texts and the module history are recompressed with it and
+        the file is vacuumed to actually shrink it. If there are too few
+        texts to train a dictionary, the texts are compressed without
+        one.
+        """
+        if zstandard is None:
+            raise RuntimeError("Compression requires the zstandard package")
+
+        rows = self._con.execute(
+            """\
+            SELECT id, version, learning_outcomes, content FROM modules_base
+            WHERE details_fetched = TRUE;"""
+        ).fetchall()
+        rows = [(id, version, self._decompress_text(lo),
+                 self._decompress_text(content))
+                for id, version, lo, content in rows]
+        revisions = [
+            (self._decompress_text(data), id)
+            for id, data in self._con.execute(
+                """\
+                SELECT id, data FROM module_revisions
+                WHERE data IS NOT NULL;"""
+            )
+        ]
+        samples = [text.encode("utf-8") for _, _, lo, content in rows
+                   for text in (lo, content) if text]
+
+        try:
+            dict_data = zstandard.train_dictionary(
+                self.COMPRESSION_DICT_SIZE, samples)
+        except zstandard.ZstdError as e:
+            self._logger.warning("Could not train dictionary: %s", e)
+        else:
+            self._logger.info("Trained dictionary with ID %d from %d texts",
+                              dict_data.dict_id(), len(samples))
+            with self._con:
+                self._con.execute(
+                    """INSERT OR IGNORE INTO compression_dicts (dict_id, data)
+                    VALUES (?, ?);""",
+                    (dict_data.dict_id(), dict_data.as_bytes())
+                )
+
+        self._load_compression_dicts()
+        compressor = zstandard.ZstdCompressor(
+            level=self.COMPRESSION_LEVEL, dict_data=self._dict_data)
+
+        def compress(text):
+            if text is None:
+                return None
+            return compressor.compress(text.encode("utf-8"))
+
+        with self._con:
+            self._touch()
+            self._con.executemany(
+                """\
+                UPDATE modules_base
+                SET learning_outcomes = ?, content = ?
+                WHERE id = ? AND version = ?;""",
+                ((compress(lo), compress(content), id, version)
+                 for id, version, lo, content in rows)
+            )
+            self._con.executemany(
+                "UPDATE module_revisions SET data = ? WHERE id = ?;",
+                ((compress(data), id) for data, id in revisions)
+            )
+        self._con.execute("VACUUM;")
+
     def program_exists(self, program_id):
         """Check if a degree program exists in the database."""
         row = self._con.execute("SELECT id FROM programs WHERE id = ?",
@@ -107,16 +700,77 @@ class Database:
         ).fetchone()
         return row
 
+    def program_complete(self, program_id):
+        """Check if all module lists of a program have been saved."""
+        row = self._con.execute(
+            "SELECT areas_complete FROM programs WHERE id = ?", (program_id,)
+        ).fetchone()
+        return row is not None and bool(row[0])
+
     def save_program(self, program_id, title, degree_type):
-        """Save a degree program to the DB."""
+        """Save a degree program to the DB.
+
+        The program is saved as incomplete, see set_program_complete().
+        """
+        with self._con:
+            self._touch()
+            self._con.execute(
+                "INSERT INTO programs (id, title, degree) VALUES (?, ?, ?);",
+                (program_id, title, degree_type)
+            )
+
+    def set_program_complete(self, program_id):
+        """Mark that all module lists of a program have been saved."""
         with self._con:
-            self._con.execute("INSERT INTO programs VALUES (?, ?, ?);",
-                              (program_id, title, degree_type))
+            self._touch()
+            self._con.execute(
+                "UPDATE programs SET areas_complete = TRUE WHERE id = ?;",
+                (program_id,)
+            )
+
+    def get_areas(self, program_id):
+        """Get the saved study areas of a program.
+
+        Returns a list of (id, title, parent position, modules fetched)
+        tuples, where the index in the list is the position of the area.
+        """
+        rows = self._con.execute(
+            """\
+            SELECT A.id, A.title, P.position, A.modules_fetched
+            FROM study_areas A
+            LEFT JOIN study_areas P ON P.id = A.parent_id
+            WHERE A.program_id = ?
+            ORDER BY A.position;""",
+            (program_id,)
+        ).fetchall()
+        return [(id, title, parent, bool(fetched))
+                for id, title, parent, fetched in rows]
+
+    def delete_areas(self, program_id):
+        """Delete a program's study areas and their module lists."""
+        with self._con:
+            self._touch()
+            for table, column in (("modules_study_areas", "study_area_id"),
+                                  ("study_area_closure", "descendant_id"),
+                                  ("study_area_stats", "area_id")):
+                self._con.execute(
+                    f"""\
+                    DELETE FROM {table} WHERE {column} IN (
+                      SELECT id FROM study_areas WHERE program_id = ?
+                    );""",
+                    (program_id,)
+                )
+            self._con.execute(
+                "DELETE FROM study_areas WHERE program_id = ?;", (program_id,)
+            )
 
     def save_area(self, area, program_id):
         """Save an area and its subareas to the DB.
 
-        Also creates the area <-> module mapping in modules_study_areas.
+        The module lists are not saved, see save_area_modules(). The
+        position of each area is its index, and its db_id is set to its
+        ID in the database. The paths to all ancestors are saved in the
+        closure table.
 
         area must not have a parent.
         """
@@ -128,95 +782,658 @@ class Database:
             first_id = first_id[0] + 1
 
         a_data = []
-        ma_data = []
-        areas = area.flatten()
-        for i, a in enumerate(areas):
-            if a.parent is None:
-                parent_id = None
-            else:
-                parent_id = first_id + areas.index(a.parent)
+        closure_data = []
+        for i, a in enumerate(area.flatten()):
+            a.db_id = first_id + i
+            parent_id = None if a.parent is None else a.parent.db_id
+            a_data.append((a.db_id, a.title, parent_id, program_id, a.index))
+            ancestor, depth = a, 0
+            while ancestor is not None:
+                closure_data.append((ancestor.db_id, a.db_id, depth))
+                ancestor, depth = ancestor.parent, depth + 1
+
+        with self._con:
+            self._touch()
+            self._con.executemany(
+                """\
+                INSERT INTO study_areas (
+                  id, title, parent_id, program_id, position
+                ) VALUES (?, ?, ?, ?, ?);""",
+                a_data
+            )
+            self._con.executemany(
+                "INSERT INTO study_area_closure VALUES (?, ?, ?);",
+                closure_data
+            )
+
+    def save_area_modules(self, area, new_modules):
+        """Save the module list of an area (not including subareas!).
 
-            a_data.append((
-                first_id + i,
-                a.title,
-                parent_id,
-                program_id
-            ))
-            ma_data += [(first_id + i, m.id, m.version) for m in a.modules]
+        new_modules -- The modules of the area that are not in the DB
+                       yet. They are saved, too.
 
+        Everything is committed at once, and modules_fetched is set to
+        TRUE for the area.
+        """
+        exam_type_ids = [self._lookup_id("exam_types", m.exam_type)
+                         for m in new_modules]
         with self._con:
+            self._touch()
             self._con.executemany(
-                "INSERT INTO study_areas VALUES (?, ?, ?, ?);", a_data
+                """INSERT INTO modules_base (
+                  id, version, title, ects, exam_type_id
+                ) VALUES (?, ?, ?, ?, ?);""",
+                ((m.id, m.version, m.title, m.ects, exam_type_id)
+                 for m, exam_type_id in zip(new_modules, exam_type_ids))
             )
             self._con.executemany(
-                "INSERT INTO modules_study_areas VALUES (?, ?, ?);", ma_data
+                "INSERT INTO modules_study_areas VALUES (?, ?, ?);",
+                ((area.db_id, m.id, m.version) for m in area.modules)
+            )
+            self._con.execute(
+                "UPDATE study_areas SET modules_fetched = TRUE WHERE id = ?;",
+                (area.db_id,)
             )
 
+    def get_area_modules(self, area_id):
+        """Get the saved module list of an area (without subareas!).
+
+        The modules are in the order they were listed in.
+        """
+        rows = self._con.execute(
+            """\
+            SELECT M.id, M.version, M.title, M.ects, M.exam_type
+            FROM modules_study_areas I
+            INNER JOIN modules M
+              ON M.id = I.module_id AND M.version = I.module_version
+            WHERE I.study_area_id = ?
+            ORDER BY I.rowid;""",
+            (area_id,)
+        ).fetchall()
+        return [Module(*r) for r in rows]
+
+    def refresh_area_stats(self, program_id):
+        """Recompute the subtree aggregates of a program's study areas.
+
+        For each area, study_area_stats contains the number of distinct
+        modules in it and its subareas, the sum of their ECTS and the
+        sum of the SWS of their parts (as far as the details have been
+        fetched).
+        """
+        with self._con:
+            self._touch()
+            self._con.execute(
+                """\
+                DELETE FROM study_area_stats WHERE area_id IN (
+                  SELECT id FROM study_areas WHERE program_id = ?
+                );""",
+                (program_id,)
+            )
+            self._con.execute(
+                """\
+                INSERT INTO study_area_stats (
+                  area_id, module_count, ects_sum, sws_sum
+                )
+                SELECT A.id, count(S.module_id), ifnull(sum(M.ects), 0),
+                  ifnull(sum(P.sws), 0)
+                FROM study_areas A
+                LEFT JOIN (
+                  SELECT DISTINCT C.ancestor_id, I.module_id, I.module_version
+                  FROM study_area_closure C
+                  INNER JOIN modules_study_areas I
+                    ON I.study_area_id = C.descendant_id
+                ) S ON S.ancestor_id = A.id
+                LEFT JOIN modules_base M
+                  ON M.id = S.module_id AND M.version = S.module_version
+                LEFT JOIN (
+                  SELECT module_id, module_version, sum(sws) AS sws
+                  FROM module_parts_base
+                  GROUP BY module_id, module_version
+                ) P ON P.module_id = S.module_id
+                  AND P.module_version = S.module_version
+                WHERE A.program_id = ?
+                GROUP BY A.id;""",
+                (program_id,)
+            )
+
+    def get_program_modules_incidence(self):
+        """Get which modules are in which programs.
+
+        Returns a list of distinct (program ID, module ID, module
+        version) tuples.
+        """
+        return self._con.execute(
+            """\
+            SELECT DISTINCT A.program_id, I.module_id, I.module_version
+            FROM modules_study_areas I
+            INNER JOIN study_areas A ON A.id = I.study_area_id;"""
+        ).fetchall()
+
+    def get_programs(self):
+        """Get a list of (ID, title, degree) tuples of all programs."""
+        return self._con.execute(
+            "SELECT id, title, degree FROM programs ORDER BY id;").fetchall()
+
+    def get_area_stats(self, area_id):
+        """Get the subtree aggregates of a study area.
+
+        Returns a (module count, ECTS sum, SWS sum) tuple, or None if
+        refresh_area_stats() has not been called for the area yet.
+        """
+        return self._con.execute(
+            """\
+            SELECT module_count, ects_sum, sws_sum FROM study_area_stats
+            WHERE area_id = ?;""",
+            (area_id,)
+        ).fetchone()
+
+    def get_subtree_modules(self, area_id):
+        """Get the modules in a study area and all of its subareas."""
+        rows = self._con.execute(
+            """\
+            SELECT DISTINCT M.id, M.version, M.title FROM study_area_closure C
+            INNER JOIN modules_study_areas I
+              ON I.study_area_id = C.descendant_id
+            INNER JOIN modules_base M
+              ON M.id = I.module_id AND M.version = I.module_version
+            WHERE C.ancestor_id = ?;""",
+            (area_id,)
+        ).fetchall()
+        return map(lambda r: Module(*r), rows)
+
     def save_module(self, module):
         """Save a module to the DB."""
         self._logger.debug("Saving %s", str(module))
+        exam_type_id = self._lookup_id("exam_types", module.exam_type)
         with self._con:
+            self._touch()
             self._con.execute(
-                """INSERT INTO modules (id, version, title, ects, exam_type)
-                VALUES (?, ?, ?, ?, ?);""",
+                """INSERT INTO modules_base (
+                  id, version, title, ects, exam_type_id
+                ) VALUES (?, ?, ?, ?, ?);""",
                 (module.id, module.version, module.title, module.ects,
-                 module.exam_type)
+                 exam_type_id)
             )
 
     def unfetched_modules(self, program_id):
         """Get a list of modules in a program with unfetched details."""
+        return self.program_modules(program_id, unfetched_only=True)
+
+    def program_modules(self, program_id, unfetched_only=False):
+        """Get a list of modules in a program.
+
+        If unfetched_only is True, only modules with unfetched details
+        are returned. Modules in the failures table are never returned,
+        see failed_modules().
+        """
+        condition = "AND M.details_fetched = FALSE" if unfetched_only else ""
         rows = self._con.execute(
-            """\
-            SELECT DISTINCT M.id, M.version, M.title FROM modules M
+            f"""\
+            SELECT DISTINCT M.id, M.version, M.title FROM modules_base M
             INNER JOIN modules_study_areas I ON M.id = I.module_id AND M.version = I.module_version
             INNER JOIN study_areas A on A.id = I.study_area_id
-            WHERE A.program_id = ? AND M.details_fetched = FALSE
+            WHERE A.program_id = ? {condition} AND NOT EXISTS (
+              SELECT 1 FROM failures F
+              WHERE F.module_id = M.id AND F.module_version = M.version
+            )
             """,
             (program_id,)
         ).fetchall()
         return map(lambda r: Module(*r), rows)
 
+    def save_failure(self, module, kind, message, retry_delay):
+        """Record that fetching the details of a module failed.
+
+        kind -- Classification of the failure (e.g. "timeout")
+        message -- Error message
+        retry_delay -- Delay before the first retry in seconds. It is
+                       doubled for every failed retry.
+        """
+        row = self._con.execute(
+            """\
+            SELECT retries FROM failures
+            WHERE module_id = ? AND module_version = ?;""",
+            (module.id, module.version)
+        ).fetchone()
+        retries = 0 if row is None else row[0] + 1
+        next_attempt = time.time() + retry_delay * 2 ** retries
+        with self._con:
+            self._con.execute(
+                """\
+                INSERT OR REPLACE INTO failures (
+                  module_id, module_version, kind, message, retries,
+                  next_attempt
+                ) VALUES (?, ?, ?, ?, ?, ?);""",
+                (module.id, module.version, kind, message, retries,
+                 next_attempt)
+            )
+        return retries
+
+    def clear_failure(self, module):
+        """Remove a module from the failures table."""
+        with self._con:
+            self._con.execute(
+                """\
+                DELETE FROM failures
+                WHERE module_id = ? AND module_version = ?;""",
+                (module.id, module.version)
+            )
+
+    def failed_modules(self, program_id, max_retries):
+        """Get the modules in a program that should be retried.
+
+        Only modules that have been retried less than max_retries times
+        are returned.
+
+        Returns a list of (module, next_attempt) tuples, ordered by
+        next_attempt (a UNIX timestamp).
+        """
+        rows = self._con.execute(
+            """\
+            SELECT M.id, M.version, M.title, F.next_attempt
+            FROM failures F
+            INNER JOIN modules_base M
+              ON M.id = F.module_id AND M.version = F.module_version
+            WHERE F.retries < ? AND EXISTS (
+              SELECT 1 FROM modules_study_areas I
+              INNER JOIN study_areas A ON A.id = I.study_area_id
+              WHERE I.module_id = M.id AND I.module_version = M.version
+                AND A.program_id = ?
+            )
+            ORDER BY F.next_attempt;""",
+            (max_retries, program_id)
+        ).fetchall()
+        return [(Module(*r[:3]), r[3]) for r in rows]
+
+    def quarantined_modules(self, program_id, max_retries):
+        """Get the modules in a program that ran out of retries.
+
+        Returns a list of (module, kind of the last failure) tuples.
+        """
+        rows = self._con.execute(
+            """\
+            SELECT M.id, M.version, M.title, F.kind
+            FROM failures F
+            INNER JOIN modules_base M
+              ON M.id = F.module_id AND M.version = F.module_version
+            WHERE F.retries >= ? AND EXISTS (
+              SELECT 1 FROM modules_study_areas I
+              INNER JOIN study_areas A ON A.id = I.study_area_id
+              WHERE I.module_id = M.id AND I.module_version = M.version
+                AND A.program_id = ?
+            )
+            ORDER BY M.id, M.version;""",
+            (max_retries, program_id)
+        ).fetchall()
+        return [(Module(*r[:3]), r[3]) for r in rows]
+
+    def reset_failures(self, program_id):
+        """Reset the retries of the failed modules in a program.
+
+        They are due for a retry right away, with the initial delay.
+
+        Returns the number of modules reset.
+        """
+        with self._con:
+            cursor = self._con.execute(
+                """\
+                UPDATE failures SET retries = 0, next_attempt = ?
+                WHERE EXISTS (
+                  SELECT 1 FROM modules_study_areas I
+                  INNER JOIN study_areas A ON A.id = I.study_area_id
+                  WHERE I.module_id = failures.module_id
+                    AND I.module_version = failures.module_version
+                    AND A.program_id = ?
+                );""",
+                (time.time(), program_id)
+            )
+        return cursor.rowcount
+
     def get_modules(self, identity_only=False):
         """Get an iterator over the modules from the database.
 
         If identity_only is True, only the id and version fields are
         set.
         """
-        rows = self._con.execute("SELECT id, version FROM modules").fetchall()
+        rows = self._con.execute(
+            "SELECT id, version FROM modules_base").fetchall()
         return map(lambda r: Module(*r), rows)
 
+    def get_module_details(self, module):
+        """Get the details of a module saved by save_module_details().
+
+        Returns None if the details have not been fetched yet.
+        """
+        row = self._con.execute(
+            """\
+            SELECT faculty, department, learning_outcomes, content
+            FROM modules
+            WHERE id = ? AND version = ? AND details_fetched = TRUE;""",
+            (module.id, module.version)
+        ).fetchone()
+        if row is None:
+            return None
+        return {
+            "faculty": row[0],
+            "department": row[1],
+            "learning_outcomes": self._decompress_text(row[2]),
+            "content": self._decompress_text(row[3])
+        }
+
+    def get_module_parts(self, module):
+        """Get the parts of a module saved by save_module_details()."""
+        rows = self._con.execute(
+            """\
+            SELECT title, language, type, turnus, sws, number
+            FROM module_parts
+            WHERE module_id = ? AND module_version = ?
+            ORDER BY id;""",
+            (module.id, module.version)
+        ).fetchall()
+        return [ModulePart(*r) for r in rows]
+
+    def get_module(self, module_id, module_version):
+        """Get everything saved about a module as a dict.
+
+        Returns None if the module is not in the DB.
+        """
+        row = self._con.execute(
+            """\
+            SELECT title, ects, exam_type, details_fetched FROM modules
+            WHERE id = ? AND version = ?;""",
+            (module_id, module_version)
+        ).fetchone()
+        if row is None:
+            return None
+        module = Module(module_id, module_version, row[0], row[1], row[2])
+        return {
+            "id": module.id,
+            "version": module.version,
+            "title": module.title,
+            "ects": module.ects,
+            "exam_type": module.exam_type,
+            "details": self.get_module_details(module),
+            "parts": [
+                {"title": p.title, "language": p.language, "type": p.type_,
+                 "turnus": p.turnus, "sws": p.sws, "number": p.number}
+                for p in self.get_module_parts(module)
+            ],
+        }
+
+    def get_program_tree(self, program_id):
+        """Get a program with its study area tree and modules as a dict.
+
+        Each area contains its modules (without details) and the
+        aggregates from study_area_stats. Returns None if the program is
+        not in the DB.
+        """
+        program = self._con.execute(
+            "SELECT title, degree, areas_complete FROM programs WHERE id = ?;",
+            (program_id,)
+        ).fetchone()
+        if program is None:
+            return None
+
+        areas = {}
+        top_level = []
+        rows = self._con.execute(
+            """\
+            SELECT A.id, A.title, A.parent_id, S.module_count, S.ects_sum,
+              S.sws_sum
+            FROM study_areas A
+            LEFT JOIN study_area_stats S ON S.area_id = A.id
+            WHERE A.program_id = ?
+            ORDER BY A.position, A.id;""",
+            (program_id,)
+        )
+        for id, title, parent_id, module_count, ects_sum, sws_sum in rows:
+            area = {
+                "id": id,
+                "title": title,
+                "module_count": module_count,
+                "ects_sum": ects_sum,
+                "sws_sum": sws_sum,
+                "modules": [],
+                "subareas": [],
+            }
+            areas[id] = area
+            if parent_id is None:
+                top_level.append(area)
+            else:
+                areas[parent_id]["subareas"].append(area)
+
+        rows = self._con.execute(
+            """\
+            SELECT I.study_area_id, M.id, M.version, M.title, M.ects,
+              M.exam_type
+            FROM modules_study_areas I
+            INNER JOIN study_areas A ON A.id = I.study_area_id
+            INNER JOIN modules M
+              ON M.id = I.module_id AND M.version = I.module_version
+            WHERE A.program_id = ?
+            ORDER BY M.title;""",
+            (program_id,)
+        )
+        for area_id, id, version, title, ects, exam_type in rows:
+            areas[area_id]["modules"].append({
+                "id": id,
+                "version": version,
+                "title": title,
+                "ects": ects,
+                "exam_type": exam_type,
+            })
+
+        return {
+            "id": int(program_id),
+            "title": program[0],
+            "degree": program[1],
+            "complete": bool(program[2]),
+            "areas": top_level,
+        }
+
     def save_module_details(self, module, details, parts):
         """Save the details/parts for a module.
 
-        details_fetched is also set to TRUE.
+        details_fetched is also set to TRUE. Previously saved parts are
+        replaced, and the details/parts are recorded as a new revision
+        in the module history.
         """
+        parts_data = [
+            (p.title, self._lookup_id("languages", p.language),
+             self._lookup_id("part_types", p.type_),
+             self._lookup_id("turnuses", p.turnus), p.sws, p.number)
+            for p in parts
+        ]
+        faculty_id = self._lookup_id("faculties", details["faculty"])
+        department_id = self._lookup_id("departments", details["department"])
         with self._con:
+            self._touch()
+            row = self._con.execute(
+                """\
+                SELECT 1 FROM module_revisions
+                WHERE module_id = ? AND module_version = ? LIMIT 1;""",
+                (module.id, module.version)
+            ).fetchone()
+            old = None if row is None else self._head_snapshot(module)
             self._con.execute(
                 """\
-                UPDATE modules
+                UPDATE modules_base
                 SET details_fetched = TRUE,
-                    faculty = ?,
-                    department = ?,
+                    faculty_id = ?,
+                    department_id = ?,
                     learning_outcomes = ?,
                     content = ?
                 WHERE id = ? AND version = ?;""",
-                (details["faculty"], details["department"],
-                 details["learning_outcomes"], details["content"],
+                (faculty_id, department_id,
+                 self._compress_text(details["learning_outcomes"]),
+                 self._compress_text(details["content"]),
                  module.id, module.version)
             )
-            parts_data = map(
-                lambda p: (p.title, p.language, p.type_, p.turnus, p.sws,
-                           p.number),
-                parts
+            self._con.execute(
+                """\
+                DELETE FROM module_parts_base
+                WHERE module_id = ? AND module_version = ?;""",
+                (module.id, module.version)
             )
             self._con.executemany(
                 f"""\
-                INSERT INTO module_parts (
-                  title, language, type, turnus, sws, number, module_id,
-                  module_version
+                INSERT INTO module_parts_base (
+                  title, language_id, type_id, turnus_id, sws, number,
+                  module_id, module_version
                 ) VALUES (
                   ?, ?, ?, ?, ?, ?, {module.id}, {module.version}
                 );
                 """,
                 parts_data
             )
+            self._save_revision(module, old)
+
+    def _head_snapshot(self, module):
+        """Get the snapshot of the details/parts saved for a module."""
+        return history.make_snapshot(self.get_module_details(module),
+                                     self.get_module_parts(module))
+
+    def _save_revision(self, module, old):
+        """Record the details/parts just saved in the module history.
+
+        old -- Snapshot of the module before they were saved (None if
+               the module has no revisions yet)
+
+        The details/parts saved in modules_base are the head revision,
+        which stores no data. If they did not change, only a reference
+        to the head is stored. Otherwise a new head is stored and the
+        old head becomes a reverse delta (turning the new head into
+        it), unless the chain of deltas before it is already
+        MAX_DELTA_CHAIN long, in which case it becomes a full snapshot.
+
+        Must be called inside a transaction.
+        """
+        snapshot = self._head_snapshot(module)
+        digest = history.digest(snapshot)
+        row = self._con.execute(
+            """\
+            SELECT id, digest FROM module_revisions
+            WHERE module_id = ? AND module_version = ? AND kind = 'head';""",
+            (module.id, module.version)
+        ).fetchone()
+
+        if row is not None and row[1] == digest:
+            kind, base_id = "same", row[0]
+        else:
+            kind, base_id = "head", None
+        head_id = self._con.execute(
+            """\
+            INSERT INTO module_revisions (
+              module_id, module_version, kind, base_id, digest
+            ) VALUES (?, ?, ?, ?, ?);""",
+            (module.id, module.version, kind, base_id, digest)
+        ).lastrowid
+        if row is None or kind == "same":
+            return
+
+        kinds = [r[0] for r in self._con.execute(
+            """\
+            SELECT kind FROM module_revisions
+            WHERE module_id = ? AND module_version = ? AND kind != 'same'
+              AND id < ?
+            ORDER BY id DESC LIMIT ?;""",
+            (module.id, module.version, row[0], self.MAX_DELTA_CHAIN)
+        )]
+        if kinds.count("delta") == self.MAX_DELTA_CHAIN:
+            kind, base_id, data = "full", None, old
+        else:
+            kind, base_id = "delta", head_id
+            data = history.make_delta(snapshot, old)
+        self._con.execute(
+            """\
+            UPDATE module_revisions SET kind = ?, base_id = ?, data = ?
+            WHERE id = ?;""",
+            (kind, base_id,
+             self._compress_text(json.dumps(data, ensure_ascii=False)),
+             row[0])
+        )
+
+    def _load_revision(self, revision_id):
+        """Reconstruct the snapshot of a revision.
+
+        Returns the snapshot and the number of deltas that had to be
+        applied to get it.
+        """
+        deltas = []
+        while True:
+            module_id, module_version, kind, base_id, data = \
+                self._con.execute(
+                    """\
+                    SELECT module_id, module_version, kind, base_id, data
+                    FROM module_revisions
+                    WHERE id = ?;""",
+                    (revision_id,)
+                ).fetchone()
+            data = self._decompress_text(data)
+            if kind in ("full", "head"):
+                break
+            if kind == "delta":
+                deltas.append(json.loads(data))
+            revision_id = base_id
+
+        if kind == "head":
+            snapshot = self._head_snapshot(Module(module_id, module_version))
+        else:
+            snapshot = json.loads(data)
+        for delta in reversed(deltas):
+            snapshot = history.apply_delta(snapshot, delta)
+        return snapshot, len(deltas)
+
+    @staticmethod
+    def _timestamp(when, end=False):
+        """Convert a datetime, date or string to the observed_at format.
+
+        Strings are assumed to be in that format (YYYY-MM-DD HH:MM:SS,
+        UTC) already. Trailing parts may be left out, which compares as
+        the start of the period. If end is True, they are filled in
+        with the end of the period instead (e.g. 2020-05-01 becomes
+        2020-05-01 23:59:59).
+        """
+        if isinstance(when, datetime.datetime):
+            return when.strftime("%Y-%m-%d %H:%M:%S")
+        when = str(when)
+        if end:
+            when += "9999-12-31 23:59:59"[len(when):]
+        return when
+
+    def module_as_of(self, module, when):
+        """Get the details and parts of a module as observed at a time.
+
+        when -- datetime (in UTC), date or string, see _timestamp(). A
+                date (or string without time) includes the whole day.
+
+        Returns the snapshot (a dict with faculty, department,
+        learning_outcomes, content and parts) of the latest revision
+        observed at or before when, or None if there is none.
+        """
+        row = self._con.execute(
+            """\
+            SELECT id FROM module_revisions
+            WHERE module_id = ? AND module_version = ? AND observed_at <= ?
+            ORDER BY observed_at DESC, id DESC LIMIT 1;""",
+            (module.id, module.version, self._timestamp(when, end=True))
+        ).fetchone()
+        if row is None:
+            return None
+        return self._load_revision(row[0])[0]
+
+    def modules_changed_since(self, when):
+        """Get modules that changed (or were first seen) after a time.
+
+        when -- datetime (in UTC), date or string, see _timestamp()
+        """
+        rows = self._con.execute(
+            """\
+            SELECT DISTINCT R.module_id, R.module_version, M.title
+            FROM module_revisions R
+            INNER JOIN modules_base M
+              ON M.id = R.module_id AND M.version = R.module_version
+            WHERE R.kind != 'same' AND R.observed_at > ?;""",
+            (self._timestamp(when),)
+        ).fetchall()
+        return map(lambda r: Module(*r), rows)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Snapshots and deltas for the module history."""
+
+import difflib
+import hashlib
+import json
+
+TEXT_FIELDS = ("learning_outcomes", "content")
+
+
+def make_snapshot(details, parts):
+    """Create a snapshot of a module's details and parts.
+
+    The snapshot is a JSON-serializable dict. Parts are stored as lists
+    of (title, language, type, turnus, sws, number).
+    """
+    snapshot = {
+        key: details[key]
+        for key in ("faculty", "department") + TEXT_FIELDS
+    }
+    snapshot["parts"] = [
+        [p.title, p.language, p.type_, p.turnus, p.sws, p.number]
+        for p in parts
+    ]
+    return snapshot
+
+
+def digest(snapshot):
+    """Get a digest identifying the content of a snapshot."""
+    data = json.dumps(snapshot, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def _diff_lines(old, new):
+    """Create a line-based edit script turning old into new.
+
+    The script is a list of operations:
+    n > 0 -- copy the next n lines of old
+    n < 0 -- skip the next -n lines of old
+    str -- insert the string
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines,
+                                      autojunk=False)
+    ops = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(i1 - i2)
+        if j2 > j1:
+            ops.append("".join(new_lines[j1:j2]))
+    return ops
+
+
+def _patch_lines(old, ops):
+    """Apply an edit script created by _diff_lines()."""
+    old_lines = old.splitlines(keepends=True)
+    pos = 0
+    new = []
+    for op in ops:
+        if isinstance(op, str):
+            new.append(op)
+        elif op > 0:
+            new += old_lines[pos:pos + op]
+            pos += op
+        else:
+            pos -= op
+    return "".join(new)
+
+
+def make_delta(old, new):
+    """Create a delta turning snapshot old into snapshot new.
+
+    Changed texts are stored as line-based edit scripts (only if both
+    versions are set), all other changed fields are stored as is.
+    """
+    delta = {"lines": {}, "set": {}}
+    for key, value in new.items():
+        if old.get(key) == value:
+            continue
+        if key in TEXT_FIELDS and old.get(key) is not None \
+           and value is not None:
+            delta["lines"][key] = _diff_lines(old[key], value)
+        else:
+            delta["set"][key] = value
+    return delta
+
+
+def apply_delta(snapshot, delta):
+    """Apply a delta created by make_delta() to a snapshot."""
+    snapshot = dict(snapshot)
+    for key, ops in delta["lines"].items():
+        snapshot[key] = _patch_lines(snapshot[key], ops)
+    snapshot.update(delta["set"])
+    return snapshot
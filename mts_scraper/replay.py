@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Recording and replaying the responses the scraper receives."""
+
+import base64
+import collections
+import gzip
+import http.server
+import json
+import logging
+import re
+import threading
+import time
+import urllib.parse
+from selenium.common.exceptions import WebDriverException
+
+
+class Recorder:
+    """Recorder for the responses the browser receives.
+
+    The browser must be created with performance logging enabled (see
+    CAPABILITY). drain() reads the network events from the log, fetches
+    the bodies of finished responses via the DevTools protocol and
+    appends them to the archive, a gzipped JSON lines file with one
+    response per line.
+
+    Bodies can only be fetched for responses in the current tab, so
+    recordings should be made with a single tab.
+    """
+
+    CAPABILITY = ("goog:loggingPrefs", {"performance": "ALL"})
+
+    def __init__(self, archive_file, log_level=logging.INFO):
+        """Open the archive for writing."""
+        logging.getLogger(__name__).setLevel(log_level)
+        self._logger = logging.getLogger(__name__ + ".Recorder")
+
+        self._archive = gzip.open(archive_file, "wt", encoding="utf-8")
+        # requestId -> request/response info of unfinished requests
+        self._requests = {}
+        self.recorded = 0
+
+    def close(self):
+        """Close the archive."""
+        self._archive.close()
+
+    def _write(self, request, status, headers, body, finished):
+        """Append a response to the archive."""
+        entry = {
+            "method": request["method"],
+            "url": request["url"],
+            "post_data": request.get("postData"),
+            "status": status,
+            "headers": headers,
+            "body": base64.b64encode(body).decode("ascii"),
+            "latency": finished - request["started"],
+        }
+        self._archive.write(json.dumps(entry) + "\n")
+        self.recorded += 1
+
+    def drain(self, browser):
+        """Record the responses that finished since the last call."""
+        for log_entry in browser.get_log("performance"):
+            message = json.loads(log_entry["message"])["message"]
+            method = message["method"]
+            params = message.get("params", {})
+            request_id = params.get("requestId")
+
+            if method == "Network.requestWillBeSent":
+                redirect = params.get("redirectResponse")
+                if redirect is not None and request_id in self._requests:
+                    self._write(self._requests[request_id],
+                                redirect["status"], redirect["headers"], b"",
+                                params["timestamp"])
+                request = dict(params["request"])
+                request["started"] = params["timestamp"]
+                self._requests[request_id] = request
+            elif method == "Network.responseReceived" and \
+                    request_id in self._requests:
+                response = params["response"]
+                self._requests[request_id]["response"] = response
+            elif method == "Network.loadingFinished" and \
+                    request_id in self._requests:
+                request = self._requests.pop(request_id)
+                if "response" not in request:
+                    continue
+                try:
+                    result = browser.execute_cdp_cmd(
+                        "Network.getResponseBody", {"requestId": request_id})
+                except WebDriverException as e:
+                    self._logger.debug("No body for %s: %s", request["url"],
+                                       e)
+                    continue
+                if result.get("base64Encoded"):
+                    body = base64.b64decode(result["body"])
+                else:
+                    body = result["body"].encode("utf-8")
+                response = request["response"]
+                self._write(request, response["status"], response["headers"],
+                            body, params["timestamp"])
+            elif method == "Network.loadingFailed":
+                self._requests.pop(request_id, None)
+        self._archive.flush()
+
+
+class ReplayServer:
+    """Local stand-in for MTS serving the responses from an archive.
+
+    Responses are matched by method, path (including the query) and
+    request body. If no response matches the body (e.g. because the
+    browser generated some IDs itself), the responses for the method
+    and path are used in the order they were recorded. The last
+    response for a key is repeated if it is requested more often than
+    it was recorded.
+    """
+
+    # Headers not to pass on from the archive. The body has been
+    # decoded already, and its length may change by rewriting.
+    SKIP_HEADERS = {"content-encoding", "content-length", "transfer-encoding",
+                    "connection", "strict-transport-security"}
+    TEXT_TYPES = ("text/", "javascript", "json", "xml")
+
+    def __init__(self, archive_file, host="127.0.0.1", port=0, latency=False,
+                 log_level=logging.INFO):
+        """Load the archive and bind the server.
+
+        latency -- Delay each response by its recorded latency
+        """
+        logging.getLogger(__name__).setLevel(log_level)
+        self._logger = logging.getLogger(__name__ + ".ReplayServer")
+
+        self._latency = latency
+        self._lock = threading.Lock()
+        self._by_body = collections.defaultdict(collections.deque)
+        self._by_path = collections.defaultdict(collections.deque)
+        self._origins = set()
+        with gzip.open(archive_file, "rt", encoding="utf-8") as archive:
+            for line in archive:
+                entry = json.loads(line)
+                url = urllib.parse.urlsplit(entry["url"])
+                self._origins.add(f"{url.scheme}://{url.netloc}")
+                path = self._path(entry["url"])
+                self._by_body[(entry["method"], path,
+                               entry["post_data"])].append(entry)
+                self._by_path[(entry["method"], path)].append(entry)
+        self._logger.info("Loaded %d responses",
+                          sum(map(len, self._by_path.values())))
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                server._handle(self, None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = self.rfile.read(length).decode("utf-8")
+                server._handle(self, body)
+
+            def log_message(self, format, *args):
+                server._logger.debug("%s - " + format,
+                                     self.address_string(), *args)
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.url = "http://%s:%d" % self._httpd.server_address
+        self._thread = None
+
+    @staticmethod
+    def _path(url):
+        """Get the path (including the query) of a URL."""
+        url = urllib.parse.urlsplit(url)
+        return url.path + ("?" + url.query if url.query else "")
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever,
+                                        daemon=True)
+        self._thread.start()
+        self._logger.info("Replaying on %s", self.url)
+
+    def shutdown(self):
+        """Stop the server."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _next(self, responses):
+        """Get the next response from a queue, repeating the last."""
+        if len(responses) > 1:
+            return responses.popleft()
+        return responses[0]
+
+    def _find(self, method, path, body):
+        """Find the response for a request, or None if there is none."""
+        with self._lock:
+            responses = self._by_body.get((method, path, body))
+            if responses:
+                entry = self._next(responses)
+                # Keep the responses by path in sync
+                by_path = self._by_path[(method, path)]
+                if len(by_path) > 1 and entry in by_path:
+                    by_path.remove(entry)
+                return entry
+            responses = self._by_path.get((method, path))
+            if responses:
+                return self._next(responses)
+        return None
+
+    def _rewrite(self, text):
+        """Point absolute URLs of the recorded origins to the server."""
+        for origin in self._origins:
+            text = text.replace(origin, self.url)
+        return text
+
+    def _handle(self, handler, body):
+        """Answer a request from the archive."""
+        entry = self._find(handler.command, handler.path, body)
+        if entry is None:
+            self._logger.warning("No recorded response for %s %s",
+                                 handler.command, handler.path)
+            handler.send_response(404)
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        if self._latency:
+            time.sleep(entry["latency"])
+
+        content = base64.b64decode(entry["body"])
+        headers = {k.lower(): v for k, v in entry["headers"].items()}
+        if any(t in headers.get("content-type", "") for t in self.TEXT_TYPES):
+            content = self._rewrite(content.decode("utf-8")).encode("utf-8")
+
+        handler.send_response(entry["status"])
+        for name, value in headers.items():
+            if name in self.SKIP_HEADERS:
+                continue
+            # DevTools joins repeated headers with newlines
+            for value in value.split("\n"):
+                if name == "location":
+                    value = self._rewrite(value)
+                elif name == "set-cookie":
+                    # The server is plain HTTP on another domain
+                    value = re.sub(r";\s*(Secure|Domain=[^;]*|SameSite=[^;]*)",
+                                   "", value, flags=re.IGNORECASE)
+                handler.send_header(name, value)
+        handler.send_header("Content-Length", str(len(content)))
+        handler.end_headers()
+        handler.wfile.write(content)
@@ -1,41 +1,104 @@
 #!/usr/bin/env python3
 """Selenium-based scraper for MTS."""
 
+import collections
+import concurrent.futures
 import logging
+import re
 import time
+import urllib.parse
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    TimeoutException,
+    WebDriverException,
+)
+
+from .supervisor import DriverSupervisor
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
 
 
 class Scraper:
     """Selenium-based scraper for MTS."""
 
-    MTS_BASE = "https://moseskonto.tu-berlin.de/moses/modultransfersystem/"
+    MTS_HOST = "https://moseskonto.tu-berlin.de"
+    MTS_BASE = MTS_HOST + "/moses/modultransfersystem/"
     PROGRAM_SEARCH = MTS_BASE + "studiengaenge/suchen.html"
     PROGRAM_SEARCH_FORM_ID = "j_idt99"
     SHOW_COMBINED = MTS_BASE + "studiengaenge/anzeigenKombiniert.html"
     SHOW_MODULE = MTS_BASE + "bolognamodule/beschreibung/anzeigen.html"
+    # The last box on a module page
+    MODULE_LOADED_XPATH = "//*[contains(@id,'BoxLiteratur')]"
+
+    def __init__(self, log_level=logging.INFO, throttle_delay=2.0,
+                 recycle_pages=500, max_memory=2000, max_latency=20.0,
+                 host=None, recorder=None):
+        """Create the Selenium WebDriver.
+
+        recycle_pages, max_memory and max_latency are the limits for
+        recycling the WebDriver session, see DriverSupervisor.
 
-    def __init__(self, log_level=logging.INFO, throttle_delay=2.0):
-        """Create the Selenium WebDriver."""
+        host -- Scheme and host to use instead of MTS_HOST (e.g. of a
+                replay.ReplayServer)
+        recorder -- replay.Recorder to record all responses with
+        """
         logging.getLogger(__name__).setLevel(log_level)
         self._logger = logging.getLogger(__name__ + ".Scraper")
 
-        option = webdriver.ChromeOptions()
-        option.add_argument("--incognito")
-        self.browser = webdriver.Chrome(options=option)
+        if host is not None:
+            for name in ("MTS_BASE", "PROGRAM_SEARCH", "SHOW_COMBINED",
+                         "SHOW_MODULE"):
+                url = getattr(self, name).replace(self.MTS_HOST, host, 1)
+                setattr(self, name, url)
+        self._recorder = recorder
+
+        self._supervisor = DriverSupervisor(
+            self._create_browser, log_level=log_level,
+            max_pages=recycle_pages, max_memory=max_memory,
+            max_latency=max_latency
+        )
         self._last_request = 0
         self._throttle_delay = throttle_delay
+        self.program_id = None
         self.combined_form_id = None
         self.study_area_id = None
 
     def __del__(self):
-        """Close the Selenium WebDriver."""
-        self.browser.close()
+        """Quit the Selenium WebDriver."""
+        self._supervisor.quit()
+
+    @property
+    def browser(self):
+        """The current Selenium WebDriver."""
+        return self._supervisor.browser
+
+    def _create_browser(self):
+        """Create a new Selenium WebDriver."""
+        option = webdriver.ChromeOptions()
+        option.add_argument("--incognito")
+        if self._recorder is not None:
+            option.set_capability(*self._recorder.CAPABILITY)
+        return webdriver.Chrome(options=option)
+
+    def _restore_state(self):
+        """Restore the state of the scraper after a session restart.
+
+        If a program was loaded, it is loaded again. Areas from
+        get_areas() reference elements of the old session, so they
+        can't be used anymore.
+        """
+        if self.program_id is not None:
+            self._logger.info("Reloading program %s", self.program_id)
+            self.load_program(self.program_id)
 
     def _throttle_request(self):
         """Check rate limit and (potentially) wait."""
@@ -46,16 +109,33 @@ class Scraper:
             diff = self._throttle_delay - (time.time() - self._last_request)
         self._last_request = time.time()
 
-    def _load_page(self, url, wait_for, timeout=10.0):
+    def _load_page(self, url, wait_for, timeout=10.0, supervise=True):
         """Load a page and wait for it to load.
 
         url -- URL of page to load
         wait_for -- See _wait_for()
         timeout -- See _wait_for()
+        supervise -- Check the health of the session before loading the
+                     page and recycle it if needed. This must be False
+                     if the page is loaded as part of a longer
+                     interaction (e.g. with multiple tabs).
         """
+        if supervise and self._supervisor.check():
+            self._restore_state()
         self._throttle_request()
-        self.browser.get(url)
+        start = time.time()
+        try:
+            self.browser.get(url)
+        except WebDriverException:
+            if not supervise or self._supervisor.is_alive():
+                raise
+            self._supervisor.restart("session died while loading " + url)
+            self._restore_state()
+            self._throttle_request()
+            start = time.time()
+            self.browser.get(url)
         self._wait_for(wait_for, timeout)
+        self._supervisor.record_page(time.time() - start)
 
     def _wait_for(self, wait_for, timeout=10.0):
         """Wait for a condition.
@@ -92,6 +172,8 @@ class Scraper:
             raise RuntimeError("Unknown wait-for " + repr(wait_for))
 
         WebDriverWait(self.browser, timeout).until(until)
+        if self._recorder is not None:
+            self._recorder.drain(self.browser)
 
     def _click_at_element(self, element):
         """Click at the position of an element.
@@ -148,14 +230,23 @@ class Scraper:
 
     def load_program(self, combined_id):
         """Load the page for a degree program."""
+        self.program_id = combined_id
+        self.combined_form_id = self._load_program_page(combined_id)
+        self.study_area_id = self.combined_form_id + ":studiengangsbereich"
+
+    def _load_program_page(self, combined_id):
+        """Load the page for a degree program in the current tab.
+
+        Returns the ID of the combined form.
+        """
         self._load_page(
             f"{self.SHOW_COMBINED}?id={combined_id}",
-            ("vis_css", "table[role=treegrid]")
+            ("vis_css", "table[role=treegrid]"),
+            supervise=False
         )
-        self.combined_form_id = self.browser.find_element_by_css_selector(
+        return self.browser.find_element_by_css_selector(
             "main form"
         ).get_attribute("id")
-        self.study_area_id = self.combined_form_id + ":studiengangsbereich"
 
     def get_program_info(self):
         """Get degree title and type from the currently loaded page.
@@ -199,7 +290,7 @@ class Scraper:
             return []
 
         areas = []
-        for row in rows:
+        for index, row in enumerate(rows):
             # We need to figure out the parent to append to. Unless
             # we're at top level, this is always the last area at the
             # level above.
@@ -213,7 +304,7 @@ class Scraper:
                 parent = above[-1]
                 above = above[-1].subareas
 
-            area = Area(row, parent)
+            area = Area(row, parent, index)
             above.append(area)
 
         return areas
@@ -254,9 +345,98 @@ class Scraper:
 
     def get_area_modules(self, area):
         """Get modules for an area (not including subareas!)."""
+        el = self._click_area(area.element, self.study_area_id)
+        return self._collect_area_modules(el, area, self.study_area_id)
+
+    def fetch_area_modules(self, areas, tabs=1):
+        """Fetch the modules for a list of areas.
+
+        areas -- List of areas to fetch (e.g. from Area.flatten()).
+                 Subareas are only fetched if they are in the list.
+        tabs -- Number of browser tabs to spread the areas over. All
+                clicks share the rate limit, so this only pays off if
+                the module table of an area takes longer than the rate
+                limit to load. Each additional tab also loads the
+                program page and expands its treegrid first (rate
+                limited as well).
+
+        This is a generator which sets the modules of each area and
+        then yields it. With more than one tab, the areas may be
+        yielded out of order.
+
+        You should call load_program() before calling this function.
+        """
+        if tabs <= 1:
+            for area in areas:
+                area.modules = self.get_area_modules(area)
+                yield area
+            return
+
+        main = self.browser.current_window_handle
+        # handle -> (study area ID, treegrid rows or None for main tab)
+        tab_info = {main: (self.study_area_id, None)}
+        try:
+            for _ in range(tabs - 1):
+                handle = self._open_tab()
+                self.browser.switch_to.window(handle)
+                form_id = self._load_program_page(self.program_id)
+                self._expand_treegrid("table[role=treegrid] tbody")
+                rows = self.browser.find_elements_by_css_selector(
+                    "table[role=treegrid] tbody tr")
+                tab_info[handle] = (form_id + ":studiengangsbereich", rows)
+
+            queue = collections.deque(areas)
+            pending = {}
+            while queue or pending:
+                # Start an area on every idle tab, so the requests of
+                # all tabs are in flight at the same time...
+                for handle, (sa_id, rows) in tab_info.items():
+                    if not queue or handle in pending:
+                        continue
+                    area = queue.popleft()
+                    self.browser.switch_to.window(handle)
+                    row = area.element if rows is None else rows[area.index]
+                    pending[handle] = (area, self._click_area(row, sa_id))
+                # ...then collect the results.
+                for handle in list(pending):
+                    area, el = pending.pop(handle)
+                    self.browser.switch_to.window(handle)
+                    area.modules = self._collect_area_modules(
+                        el, area, tab_info[handle][0])
+                    yield area
+        finally:
+            for handle in tab_info:
+                if handle != main:
+                    self.browser.switch_to.window(handle)
+                    self.browser.close()
+            self.browser.switch_to.window(main)
+
+    def _open_tab(self):
+        """Open a new (blank) tab and return its handle.
+
+        The current tab stays selected.
+        """
+        handles = set(self.browser.window_handles)
+        self.browser.execute_script("window.open('about:blank');")
+        return (set(self.browser.window_handles) - handles).pop()
+
+    def _click_area(self, row, study_area_id):
+        """Click at the tr of an area in the current tab.
+
+        Returns the study area element that is going to be replaced.
+        """
         self._throttle_request()
-        el = self.browser.find_element_by_id(self.study_area_id)
-        self._click_at_element(area.element)
+        el = self.browser.find_element_by_id(study_area_id)
+        self._click_at_element(row)
+        return el
+
+    def _collect_area_modules(self, el, area, study_area_id):
+        """Get the modules for an area after it was clicked at.
+
+        el -- The study area element returned by _click_area()
+        area -- The area that was clicked at, only used for logging
+        study_area_id -- ID of the study area element in the current tab
+        """
         # When the study area element is clicked (not necessarily
         # changed), the study area element is removed and a new one is
         # added.
@@ -264,10 +444,10 @@ class Scraper:
             "cond",
             EC.staleness_of(el)
         ))
-        self._wait_for(("vis_id", self.study_area_id))
+        self._wait_for(("vis_id", study_area_id))
 
         rows = self.browser.find_elements_by_css_selector(
-            "#" + self.study_area_id.replace(":", r"\:") + " tbody tr"
+            "#" + study_area_id.replace(":", r"\:") + " tbody tr"
         )
 
         modules = []
@@ -288,16 +468,187 @@ class Scraper:
                                   area.title)
         return modules
 
+    def _module_url(self, module_id, module_version):
+        """Get the URL of a module's page."""
+        return (f"{self.SHOW_MODULE}?number={module_id}"
+                f"&version={module_version}")
+
+    @staticmethod
+    def _is_module_url(url, module):
+        """Check whether a URL is the page of a module."""
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query)
+        return query.get("number") == [str(module.id)] and \
+            query.get("version") == [str(module.version)]
+
     def get_module_details(self, module_id, module_version):
         """Get module details."""
         self._load_page(
-            f"{self.SHOW_MODULE}?number={module_id}&version={module_version}",
-            ("vis_xpath", "//*[contains(@id,'BoxLiteratur')]")
+            self._module_url(module_id, module_version),
+            ("vis_xpath", self.MODULE_LOADED_XPATH)
         )
         details = self._get_module_page_details(module_id, module_version)
         module_parts = self._get_module_parts(module_id, module_version)
         return details, module_parts
 
+    def iter_module_details(self, modules, prefetch=False, workers=2):
+        """Get module details, parsing pages while loading the next one.
+
+        The page source of each module is captured right after it has
+        loaded and parsed with ModulePageParser in a worker thread,
+        while the browser already loads the next module. This requires
+        lxml.
+
+        modules -- Iterable of modules to fetch
+        prefetch -- Start loading the next module in a second tab while
+                    waiting for the current one. This only helps if
+                    loading a page takes longer than the rate limit.
+        workers -- Number of worker threads for parsing
+
+        This is a generator yielding (module, future) tuples in the
+        order of modules. The result of the future is what
+        get_module_details() would have returned; errors are raised by
+        its result() method.
+        """
+        if lxml is None:
+            raise RuntimeError("Pipelined fetching requires lxml")
+
+        parser = ModulePageParser()
+        if prefetch:
+            sources = self._iter_module_sources_prefetch(modules)
+        else:
+            sources = self._iter_module_sources(modules)
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            previous = None
+            for module, source in sources:
+                if isinstance(source, Exception):
+                    future = concurrent.futures.Future()
+                    future.set_exception(source)
+                else:
+                    future = executor.submit(parser.parse, source, module.id,
+                                             module.version)
+                # Hand out the previous module only now, so its page was
+                # parsed while this one was loading.
+                if previous is not None:
+                    yield previous
+                previous = (module, future)
+            if previous is not None:
+                yield previous
+
+    def _iter_module_sources(self, modules):
+        """Load module pages, yield (module, page source) tuples.
+
+        If loading a page fails, the exception is yielded instead of the
+        page source.
+        """
+        for module in modules:
+            try:
+                self._load_page(
+                    self._module_url(module.id, module.version),
+                    ("vis_xpath", self.MODULE_LOADED_XPATH)
+                )
+                yield module, self.browser.page_source
+            except WebDriverException as e:
+                yield module, e
+
+    def _iter_module_sources_prefetch(self, modules):
+        """Like _iter_module_sources(), but prefetch in a second tab.
+
+        While waiting for a module's page in one tab, the next module's
+        page is already requested (as soon as the rate limit allows) in
+        the other tab.
+        """
+        modules = iter(modules)
+        tabs = None
+        generation = None
+        # Requested modules in order: (tab handle, module, request time)
+        pending = collections.deque()
+
+        def request(module, tab):
+            """Request a module's page in a tab.
+
+            Returns the exception if requesting failed. If the session
+            died, the module is requested again after the restart.
+            """
+            try:
+                self.browser.switch_to.window(tab)
+                self._throttle_request()
+                # Navigate asynchronously, so we don't wait for the page
+                self.browser.execute_script(
+                    "var url = arguments[0];"
+                    "setTimeout(function() {"
+                    "  window.location.href = url;"
+                    "}, 0);",
+                    self._module_url(module.id, module.version)
+                )
+            except WebDriverException as e:
+                if self._supervisor.is_alive():
+                    return e
+                self._logger.info("Session died while requesting (ID=%d, "
+                                  "V=%d)", module.id, module.version)
+            pending.append((tab, module, time.time()))
+            return None
+
+        try:
+            while True:
+                if generation != self._supervisor.generation or \
+                   self._supervisor.check():
+                    # (Re)started session: open the tabs, request again
+                    if generation is not None:
+                        self._restore_state()
+                    generation = self._supervisor.generation
+                    tabs = [self.browser.current_window_handle,
+                            self._open_tab()]
+                    requested = [module for _, module, _ in pending]
+                    pending.clear()
+                    for module in requested:
+                        error = request(module, tabs[len(pending) % 2])
+                        if error is not None:
+                            yield module, error
+
+                if len(pending) < 2:
+                    module = next(modules, None)
+                    if module is not None:
+                        busy = {tab for tab, _, _ in pending}
+                        error = request(module, next(t for t in tabs
+                                                     if t not in busy))
+                        if error is not None:
+                            yield module, error
+                            continue
+                if not pending:
+                    return
+
+                tab, module, start = pending.popleft()
+                try:
+                    self.browser.switch_to.window(tab)
+                    self._wait_for(("cond", lambda d: self._is_module_url(
+                        d.current_url, module)))
+                    self._wait_for(("vis_xpath", self.MODULE_LOADED_XPATH))
+                    self._supervisor.record_page(time.time() - start)
+                    yield module, self.browser.page_source
+                except WebDriverException as e:
+                    yield module, e
+        finally:
+            if tabs is not None and self._supervisor.is_alive():
+                self.browser.switch_to.window(tabs[1])
+                self.browser.close()
+                self.browser.switch_to.window(tabs[0])
+
+    @staticmethod
+    def classify_error(error):
+        """Classify an exception raised while fetching module details.
+
+        Returns one of "timeout", "missing_box" (an element we expected
+        on the page was not found), "parse_error" (the page looked
+        different than expected) or "error".
+        """
+        if isinstance(error, TimeoutException):
+            return "timeout"
+        if isinstance(error, NoSuchElementException):
+            return "missing_box"
+        if isinstance(error, (ValueError, IndexError, AttributeError)):
+            return "parse_error"
+        return "error"
+
     @staticmethod
     def _starts_with_any(haystack, needles):
         """Return True if the haystack start with any of the needles."""
@@ -434,14 +785,258 @@ class Scraper:
         return parts
 
 
+class ModulePageParser:
+    """Parser for the source of module pages.
+
+    This extracts the same information as Scraper.get_module_details(),
+    but from the page source instead of the live page, so it can run
+    while the browser loads the next page.
+    """
+
+    # Tags displayed as blocks (or table parts other than cells) by
+    # default
+    BLOCK_TAGS = {
+        "address", "article", "aside", "blockquote", "body", "caption",
+        "center", "dd", "details", "dialog", "div", "dl", "dt", "fieldset",
+        "figcaption", "figure", "footer", "form", "h1", "h2", "h3", "h4",
+        "h5", "h6", "header", "hgroup", "hr", "html", "legend", "li",
+        "main", "menu", "nav", "ol", "p", "pre", "section", "summary",
+        "table", "tbody", "tfoot", "thead", "tr", "ul",
+    }
+    # Tags that are never rendered by default
+    HIDDEN_TAGS = {"head", "noscript", "script", "style", "template",
+                   "title"}
+    # Display values that don't put an element on lines of its own
+    INLINE_DISPLAYS = {"inline", "inline-block", "inline-table", "none",
+                       "table-cell", "table-column", "table-column-group"}
+
+    def __init__(self):
+        self._logger = logging.getLogger(__name__ + ".ModulePageParser")
+
+    @staticmethod
+    def _class_is(cls):
+        """XPath predicate checking that an element has a class."""
+        return ("contains(concat(' ', normalize-space(@class), ' '), "
+                f"' {cls} ')")
+
+    @staticmethod
+    def _style(element):
+        """Get the inline style of an element as a dict."""
+        style = {}
+        for declaration in element.get("style", "").split(";"):
+            name, _, value = declaration.partition(":")
+            style[name.strip().lower()] = value.strip().lower()
+        return style
+
+    @staticmethod
+    def _trim(text):
+        """Strip whitespace other than non-breaking spaces from text."""
+        return re.sub(r"^[^\S\xa0]+|[^\S\xa0]+$", "", text)
+
+    def _text(self, element):
+        """Get the rendered text of an element like WebElement.text.
+
+        This follows Selenium's getVisibleText(): whitespace other than
+        non-breaking spaces collapses into single spaces (except in pre
+        elements), <br> starts a new line, block elements are put on
+        lines of their own (but never add blank lines), table cells are
+        separated by spaces and each line is trimmed.
+
+        Styles are only known for elements that are hidden by default,
+        have the hidden attribute or an inline style. Text hidden (or
+        transformed) by a stylesheet is kept as it is in the source.
+        """
+        lines = [""]
+
+        def add_text(text, white_space):
+            text = re.sub("[\u200b\u200e\u200f]", "", text)
+            text = re.sub(r"\r\n?", "\n", text)
+            if white_space not in ("pre", "pre-wrap", "pre-line"):
+                text = text.replace("\n", " ")
+            if white_space in ("pre", "pre-wrap"):
+                text = re.sub("[ \f\t\v\u2028\u2029]", "\xa0", text)
+            else:
+                text = re.sub("[ \f\t\v\u2028\u2029]+", " ", text)
+            if lines[-1].endswith(" ") and text.startswith(" "):
+                text = text[1:]
+            lines[-1] += text
+
+        def walk(el, displayed, visibility, white_space):
+            if el.tag == "br":
+                lines.append("")
+                return
+            style = self._style(el)
+            display = style.get("display")
+            if display is None:
+                if el.tag in self.HIDDEN_TAGS or el.get("hidden") is not None:
+                    display = "none"
+                elif el.tag in ("td", "th"):
+                    display = "table-cell"
+                elif el.tag in self.BLOCK_TAGS:
+                    display = "block"
+                else:
+                    display = "inline"
+            displayed = displayed and display != "none"
+            visibility = style.get("visibility", visibility)
+            shown = displayed and visibility == "visible"
+            white_space = style.get(
+                "white-space", "pre" if el.tag == "pre" else white_space)
+
+            block = el.tag != "td" and display not in self.INLINE_DISPLAYS
+            if block and lines[-1].strip():
+                lines.append("")
+            if el.text and shown:
+                add_text(el.text, white_space)
+            for child in el:
+                if isinstance(child.tag, str):
+                    walk(child, displayed, visibility, white_space)
+                if child.tail and shown:
+                    add_text(child.tail, white_space)
+            if (el.tag == "td" or display == "table-cell") and lines[-1] \
+               and not lines[-1].endswith(" "):
+                lines[-1] += " "
+            if block and lines[-1].strip():
+                lines.append("")
+
+        walk(element, True, "visible", "normal")
+        text = self._trim("\n".join(self._trim(line) for line in lines))
+        return text.replace("\xa0", " ")
+
+    def _first(self, element, xpath, what):
+        """Get the first element matching an XPath.
+
+        Raises a NoSuchElementException if there is none, like Selenium.
+        """
+        found = element.xpath(xpath)
+        if not found:
+            raise NoSuchElementException(f"Could not find {what}")
+        return found[0]
+
+    def _row(self, element, row):
+        """Get the row-th .row in an element (.row:nth-of-type(row))."""
+        return self._first(
+            element,
+            f".//div[{self._class_is('row')}]"
+            f"[count(preceding-sibling::div) = {row - 1}]",
+            f"row {row}"
+        )
+
+    def _remove_label_text(self, element, row, col, expected_text,
+                           log_label, module_id, module_version):
+        """See Scraper._remove_label_text()."""
+        col = self._first(
+            self._row(element, row),
+            f".//div[starts-with(@class, 'col')]"
+            f"[count(preceding-sibling::div) = {col - 1}]",
+            f"{log_label} column"
+        )
+        label = self._text(self._first(col, ".//label", "label"))
+        if not Scraper._starts_with_any(label, expected_text):
+            self._logger.warn("%s label for (ID=%d, V=%d) was %s", log_label,
+                              module_id, module_version, label)
+        return self._text(col).replace(label, "", 1).strip()
+
+    def _remove_section_header(self, element, expected_header, log_section,
+                               module_id, module_version):
+        """See Scraper._remove_section_header()."""
+        header = self._text(self._first(
+            element,
+            ".//*[self::h1 or self::h2 or self::h3 or self::h4 or self::h5 "
+            "or self::h6]",
+            f"{log_section} header"
+        ))
+        if not Scraper._starts_with_any(header, expected_header):
+            self._logger.warn("%s section header for (ID=%d, V=%d) was %s",
+                              log_section, module_id, module_version, header)
+        return self._text(element).replace(header, "", 1).strip("\n\r")
+
+    def parse(self, source, module_id=None, module_version=None):
+        """Parse the source of a module page.
+
+        Returns the same as Scraper.get_module_details().
+
+        module_id and module_version are only used for logging purposes
+        and can be left at None.
+        """
+        doc = lxml.html.fromstring(source)
+        header_info = self._first(
+            doc, "//*[contains(@id,'BoxKopfinformationen')]", "header info")
+
+        faculty = self._remove_label_text(
+            header_info, 1, 3, ("Faculty", "Fakultät"),
+            "Faculty", module_id, module_version
+        )
+        department = self._remove_label_text(
+            header_info, 2, 2, ("Area of expertise", "Fachgebiet"),
+            "Department", module_id, module_version
+        )
+
+        next_row = f"following-sibling::*[1][{self._class_is('row')}]"
+        lo_el = self._first(header_info, next_row, "learning outcomes")
+        learning_outcomes = self._remove_section_header(
+            lo_el, ("Learning Outcomes", "Lernergebnisse"),
+            "Learning Outcomes", module_id, module_version
+        )
+        content_el = self._first(lo_el, next_row, "content")
+        content = self._remove_section_header(
+            content_el, ("Content", "Lehrinhalte"),
+            "Content", module_id, module_version
+        )
+        details = {
+            "faculty": faculty,
+            "department": department,
+            "learning_outcomes": learning_outcomes,
+            "content": content
+        }
+
+        parts_box = self._first(
+            doc, "//*[contains(@id,'BoxBestandteile')]", "module parts")
+        header_row = self._row(parts_box, 1)
+        if not header_row.xpath(
+                ".//*[self::h1 or self::h2 or self::h3 or self::h4 "
+                "or self::h5 or self::h6]"):
+            self._logger.warn(
+                "Module parts header row for (ID=%d, V=%d) did not contain"
+                "header! (text instead: %s)", module_id, module_version,
+                self._text(header_row)
+            )
+
+        rows = self._row(parts_box, 2).xpath(
+            f".//table[{self._class_is('table')}]//tr[position() > 1]")
+        parts = []
+        for row in rows:
+            cols = row.xpath("./td")
+            if len(cols) != 6:
+                self._logger.warn(
+                    "Module part for (ID=%d, V=%d) has weird length %d! "
+                    "(text: %s)", module_id, module_version, len(cols),
+                    self._text(row)
+                )
+                continue
+            title, type_, number, turnus, language, sws = \
+                (self._text(col).strip() for col in cols)
+            parts.append(ModulePart(title, language, type_, turnus, sws,
+                                    number))
+
+        return details, parts
+
+
 class Area:
     """A study area from the combined page."""
 
-    def __init__(self, element, parent):
-        """Create the area for a tr from the combined page."""
+    def __init__(self, element, parent, index=None):
+        """Create the area for a tr from the combined page.
+
+        index is the position of the tr in the expanded treegrid.
+        """
         self._logger = logging.getLogger(__name__ + ".Area")
         self.element = element
         self.parent = parent
+        self.index = index
+        # ID in the database, set by Database.save_area()
+        self.db_id = None
+        # Whether the modules were saved by a previous session
+        self.modules_fetched = False
         self.title = element.find_element_by_css_selector(":first-child").text
         self.subareas = []
         self.modules = []
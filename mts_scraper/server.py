@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Read-only HTTP/JSON query server for the scraped database."""
+
+import collections
+import http.server
+import json
+import logging
+import os
+import queue
+import threading
+import urllib.parse
+
+from .db import Database
+
+
+class QueryServer:
+    """HTTP server answering queries from pooled read-only connections.
+
+    Endpoints:
+    /programs -- List of all programs
+    /programs/ID -- Program with its study area tree and modules
+    /modules/ID/VERSION -- Module with its details and parts
+
+    Responses are cached in an LRU cache, which is cleared whenever the
+    generation of the database changes (i.e. a scrape committed).
+    """
+
+    def __init__(self, db_file, host="127.0.0.1", port=8080, pool_size=4,
+                 cache_size=1024, log_level=logging.INFO):
+        """Open the connections and bind the server.
+
+        db_file -- The database to serve. It must exist already and
+                   have the current schema (see Database), it is never
+                   written to.
+        pool_size -- Number of read-only connections, i.e. the maximum
+                     number of queries answered at the same time
+        cache_size -- Maximum number of cached responses
+        """
+        logging.getLogger(__name__).setLevel(log_level)
+        self._logger = logging.getLogger(__name__ + ".QueryServer")
+
+        if not os.path.exists(db_file):
+            raise FileNotFoundError(f"Database {db_file} does not exist")
+
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            self._pool.put(Database(db_file, log_level=log_level,
+                                    read_only=True))
+        self._cache = collections.OrderedDict()
+        self._cache_size = cache_size
+        self._cache_lock = threading.Lock()
+        self._generation = None
+
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, body = server.query(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                server._logger.debug("%s - " + format,
+                                     self.address_string(), *args)
+
+        self._httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        """The (host, port) the server is bound to."""
+        return self._httpd.server_address
+
+    def serve_forever(self):
+        """Answer queries until shutdown() is called."""
+        self._logger.info("Serving on http://%s:%d/", *self.address)
+        self._httpd.serve_forever()
+
+    def shutdown(self):
+        """Stop serve_forever()."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def query(self, path):
+        """Answer a query.
+
+        Returns the HTTP status and the JSON-encoded body.
+        """
+        path = urllib.parse.urlsplit(path).path.strip("/")
+        db = self._pool.get()
+        try:
+            generation = db.generation()
+            with self._cache_lock:
+                if generation != self._generation:
+                    self._cache.clear()
+                    self._generation = generation
+                if path in self._cache:
+                    self._cache.move_to_end(path)
+                    return self._cache[path]
+
+            response = self._answer(db, path)
+        except Exception:
+            self._logger.exception("Query for %s failed", path)
+            return 500, self._encode({"error": "Internal server error"})
+        finally:
+            self._pool.put(db)
+
+        with self._cache_lock:
+            # Don't cache responses from before a concurrent scrape
+            # commit
+            if generation == self._generation:
+                self._cache[path] = response
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return response
+
+    def _answer(self, db, path):
+        """Answer a query (without caching)."""
+        parts = path.split("/")
+        try:
+            if parts == ["programs"]:
+                result = [
+                    {"id": id, "title": title, "degree": degree}
+                    for id, title, degree in db.get_programs()
+                ]
+            elif len(parts) == 2 and parts[0] == "programs":
+                result = db.get_program_tree(int(parts[1]))
+            elif len(parts) == 3 and parts[0] == "modules":
+                result = db.get_module(int(parts[1]), int(parts[2]))
+            else:
+                return 404, self._encode({"error": "Unknown endpoint"})
+        except ValueError:
+            return 400, self._encode({"error": "IDs must be integers"})
+        if result is None:
+            return 404, self._encode({"error": "Not found"})
+        return 200, self._encode(result)
+
+    @staticmethod
+    def _encode(result):
+        """Encode a result as JSON."""
+        return json.dumps(result, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Health monitoring and recycling of the Selenium WebDriver."""
+
+import collections
+import logging
+import statistics
+from selenium.common.exceptions import WebDriverException
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+class DriverSupervisor:
+    """Owner of the Selenium WebDriver that restarts it when needed.
+
+    The session is recycled after a number of page loads, if Chrome uses
+    too much memory, if page loads become too slow or if too many tabs
+    are open. Dead sessions are restarted, too.
+    """
+
+    # Number of page loads the latency is averaged over
+    LATENCY_WINDOW = 20
+
+    def __init__(self, create_browser, log_level=logging.INFO, max_pages=500,
+                 max_memory=2000, max_latency=20.0, max_tabs=8):
+        """Start the WebDriver.
+
+        create_browser -- Function returning a new WebDriver
+        max_pages -- Recycle after this many page loads
+        max_memory -- Recycle if chromedriver and Chrome use more than
+                      this many MB (requires psutil)
+        max_latency -- Recycle if the median page load takes longer
+                       than this many seconds
+        max_tabs -- Recycle if more than this many tabs are open
+
+        Any of the limits can be set to 0 to disable it.
+        """
+        logging.getLogger(__name__).setLevel(log_level)
+        self._logger = logging.getLogger(__name__ + ".DriverSupervisor")
+
+        self._create_browser = create_browser
+        self.max_pages = max_pages
+        self.max_memory = max_memory
+        self.max_latency = max_latency
+        self.max_tabs = max_tabs
+        if max_memory and psutil is None:
+            self._logger.warning(
+                "psutil is not installed, not monitoring memory usage")
+
+        self.browser = None
+        # Incremented on every (re)start, so users can notice restarts
+        self.generation = 0
+        self._start()
+
+    def _start(self):
+        """Start a new WebDriver session."""
+        self.browser = self._create_browser()
+        self.generation += 1
+        self.pages = 0
+        self._latencies = collections.deque(maxlen=self.LATENCY_WINDOW)
+
+    def quit(self):
+        """Quit the WebDriver session and chromedriver."""
+        if self.browser is None:
+            return
+        try:
+            self.browser.quit()
+        except WebDriverException as e:
+            # Most likely the session is dead already
+            self._logger.debug("Quitting the session failed: %r", e)
+        self.browser = None
+
+    def restart(self, reason):
+        """Quit the WebDriver session and start a new one."""
+        self._logger.info("Restarting browser session: %s", reason)
+        self.quit()
+        self._start()
+
+    def record_page(self, latency):
+        """Record that a page was loaded.
+
+        latency -- Seconds it took to load the page
+        """
+        self.pages += 1
+        self._latencies.append(latency)
+
+    def is_alive(self):
+        """Check whether the session still responds."""
+        try:
+            self.browser.window_handles
+        except WebDriverException:
+            return False
+        return True
+
+    def memory_usage(self):
+        """Get the memory used by chromedriver and Chrome in MB.
+
+        Returns None if psutil is not installed or the processes cannot
+        be inspected.
+        """
+        if psutil is None:
+            return None
+        try:
+            driver = psutil.Process(self.browser.service.process.pid)
+            processes = [driver] + driver.children(recursive=True)
+            rss = 0
+            for p in processes:
+                rss += p.memory_info().rss
+        except (psutil.Error, AttributeError):
+            return None
+        return rss / 2**20
+
+    def _recycle_reason(self):
+        """Get the reason the session should be recycled, if any."""
+        if self.max_pages and self.pages >= self.max_pages:
+            return f"loaded {self.pages} pages"
+        if self.max_latency and len(self._latencies) == self.LATENCY_WINDOW:
+            latency = statistics.median(self._latencies)
+            if latency > self.max_latency:
+                return f"median page load took {latency:.1f} seconds"
+        if self.max_tabs:
+            tabs = len(self.browser.window_handles)
+            if tabs > self.max_tabs:
+                return f"{tabs} tabs are open"
+        if self.max_memory:
+            memory = self.memory_usage()
+            if memory is not None and memory > self.max_memory:
+                return f"using {memory:.0f} MB of memory"
+        return None
+
+    def check(self):
+        """Check the health of the session and restart it if needed.
+
+        Returns True if the session was restarted.
+        """
+        if not self.is_alive():
+            self.restart("session is dead")
+            return True
+        reason = self._recycle_reason()
+        if reason is not None:
+            self.restart(reason)
+            return True
+        return False
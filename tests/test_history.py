@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""Tests for the module history."""
+
+import datetime
+import json
+import os
+import tempfile
+import unittest
+
+from mts_scraper import history
+from mts_scraper.db import Database, zstandard
+from mts_scraper.scraper import Module, ModulePart
+
+
+def snapshot(content="a\nb\nc\n", learning_outcomes="x\ny", parts=1):
+    """Create a snapshot with the given texts and number of parts."""
+    details = {
+        "faculty": "Fakultät IV",
+        "department": "Informatik",
+        "learning_outcomes": learning_outcomes,
+        "content": content,
+    }
+    return history.make_snapshot(details, [
+        ModulePart(f"Part {i}", "Deutsch", "VL", "WiSe", 2, str(i))
+        for i in range(parts)
+    ])
+
+
+class DeltaTest(unittest.TestCase):
+    """Round trips through make_delta() and apply_delta()."""
+
+    def assertRoundTrip(self, old, new):
+        delta = history.make_delta(old, new)
+        self.assertEqual(history.apply_delta(old, delta), new)
+        return delta
+
+    def test_unchanged(self):
+        delta = self.assertRoundTrip(snapshot(), snapshot())
+        self.assertEqual(delta, {"lines": {}, "set": {}})
+
+    def test_text_edits(self):
+        old = snapshot(content="a\nb\nc\nd\ne\n")
+        for content in ("a\nB\nc\nd\ne\n",  # replace
+                        "a\nb\nc\nd\ne\nf\n",  # append
+                        "new\na\nb\nc\nd\ne\n",  # prepend
+                        "a\nc\ne\n",  # delete
+                        "a\nb\nc\nd\ne",  # no trailing newline
+                        "",
+                        "a\r\nb\nc\n\nd\ne\n"):
+            with self.subTest(content=content):
+                delta = self.assertRoundTrip(old, snapshot(content=content))
+                self.assertIn("content", delta["lines"])
+
+    def test_text_set_and_cleared(self):
+        old = snapshot(content=None)
+        delta = self.assertRoundTrip(old, snapshot())
+        self.assertEqual(delta["set"], {"content": "a\nb\nc\n"})
+        delta = self.assertRoundTrip(snapshot(), old)
+        self.assertEqual(delta["set"], {"content": None})
+
+    def test_parts(self):
+        self.assertRoundTrip(snapshot(parts=2), snapshot(parts=0))
+        self.assertRoundTrip(snapshot(parts=0), snapshot(parts=3))
+
+    def test_digest(self):
+        self.assertEqual(history.digest(snapshot()),
+                         history.digest(snapshot()))
+        self.assertNotEqual(history.digest(snapshot()),
+                            history.digest(snapshot(content="a\n")))
+
+
+class RevisionTest(unittest.TestCase):
+    """Storing and reconstructing revisions in the database."""
+
+    compress = False
+
+    def setUp(self):
+        fd, self.db_file = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        self.db = Database(self.db_file, compress=self.compress)
+        self.module = Module(1, 2, "Module", 6, "Portfolio")
+        self.db.save_module(self.module)
+
+    def tearDown(self):
+        del self.db
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_file + suffix):
+                os.remove(self.db_file + suffix)
+
+    def save(self, content, observed_at=None):
+        """Save details with the given content as a new revision."""
+        details = {
+            "faculty": "Fakultät IV",
+            "department": "Informatik",
+            "learning_outcomes": "x\ny",
+            "content": content,
+        }
+        self.db.save_module_details(
+            self.module, details,
+            [ModulePart("Part", "Deutsch", "VL", "WiSe", 2, "1")])
+        if observed_at is not None:
+            with self.db._con:
+                self.db._con.execute(
+                    """\
+                    UPDATE module_revisions SET observed_at = ?
+                    WHERE id = (SELECT MAX(id) FROM module_revisions);""",
+                    (observed_at,)
+                )
+
+    def revisions(self):
+        """Get the (ID, kind, base ID) of all revisions."""
+        return self.db._con.execute(
+            "SELECT id, kind, base_id FROM module_revisions ORDER BY id;"
+        ).fetchall()
+
+    def test_kinds(self):
+        self.save("a\n")
+        self.save("a\n")
+        self.save("a\nb\n")
+        self.save("a\nb\n")
+        self.assertEqual(self.revisions(), [
+            (1, "delta", 3),
+            (2, "same", 1),
+            (3, "head", None),
+            (4, "same", 3),
+        ])
+        for id, content in enumerate(("a\n", "a\n", "a\nb\n", "a\nb\n"),
+                                     start=1):
+            self.assertEqual(self.db._load_revision(id)[0]["content"],
+                             content)
+
+    def test_no_copies(self):
+        # Neither the first nor an unchanged revision copies the texts
+        self.save("a\n")
+        self.save("a\n")
+        self.assertEqual(self.db._con.execute(
+            "SELECT data FROM module_revisions;").fetchall(),
+            [(None,), (None,)])
+
+    def test_forward_migration(self):
+        self.save("a\n")
+        self.save("a\n")
+        self.save("a\nb\n")
+        old, new = (self.db._load_revision(id)[0] for id in (1, 3))
+        # Before, each revision was a delta to the one before it
+        with self.db._con:
+            for id, kind, base_id, data in (
+                    (1, "full", None, old),
+                    (2, "same", 1, None),
+                    (3, "delta", 1, history.make_delta(old, new))):
+                self.db._con.execute(
+                    """\
+                    UPDATE module_revisions
+                    SET kind = ?, base_id = ?, data = ?
+                    WHERE id = ?;""",
+                    (kind, base_id, data and json.dumps(data), id)
+                )
+        del self.db
+        self.db = Database(self.db_file, compress=self.compress)
+
+        self.assertEqual(self.revisions(), [
+            (1, "delta", 3),
+            (2, "same", 1),
+            (3, "head", None),
+        ])
+        self.assertEqual(self.db._load_revision(2)[0], old)
+        self.assertEqual(self.db._load_revision(3)[0], new)
+
+    def test_chain_length(self):
+        contents = [f"line {i}\n" * (i + 1)
+                    for i in range(2 * Database.MAX_DELTA_CHAIN + 4)]
+        for content in contents:
+            self.save(content)
+
+        revisions = self.revisions()
+        kinds = [kind for _, kind, _ in revisions]
+        chain = Database.MAX_DELTA_CHAIN
+        self.assertEqual(kinds, (["delta"] * chain + ["full"]) * 2
+                         + ["delta", "head"])
+        for (id, kind, base_id), content in zip(revisions, contents):
+            snapshot, depth = self.db._load_revision(id)
+            self.assertEqual(snapshot["content"], content)
+            self.assertLessEqual(depth, chain)
+            if kind == "delta":
+                self.assertEqual(base_id, id + 1)
+
+    def test_as_of(self):
+        self.save("first\n", "2020-05-01 12:00:00")
+        self.save("second\n", "2020-05-02 00:00:00")
+        self.save("second\n", "2020-05-03 08:00:00")
+        self.save("third\n", "2020-05-04 23:59:59")
+
+        def content_as_of(when):
+            snapshot = self.db.module_as_of(self.module, when)
+            return None if snapshot is None else snapshot["content"]
+
+        self.assertIsNone(content_as_of("2020-04-30"))
+        self.assertEqual(content_as_of("2020-05-01"), "first\n")
+        self.assertEqual(content_as_of("2020-05-01 11:59:59"), None)
+        self.assertEqual(content_as_of(datetime.date(2020, 5, 2)),
+                         "second\n")
+        self.assertEqual(content_as_of("2020-05-03"), "second\n")
+        self.assertEqual(content_as_of("2020-05-04 23:59:58"), "second\n")
+        self.assertEqual(content_as_of("2020-05-04"), "third\n")
+        self.assertEqual(
+            content_as_of(datetime.datetime(2020, 5, 4, 12)), "second\n")
+
+    def test_changed_since(self):
+        self.save("first\n", "2020-05-01 12:00:00")
+        self.save("first\n", "2020-05-02 12:00:00")
+        self.assertEqual(len(list(self.db.modules_changed_since(
+            "2020-05-01"))), 1)
+        self.assertEqual(len(list(self.db.modules_changed_since(
+            "2020-05-02"))), 0)
+
+
+@unittest.skipIf(zstandard is None, "zstandard is not installed")
+class CompressedRevisionTest(RevisionTest):
+    """Storing and reconstructing compressed revisions."""
+
+    compress = True
+
+    def test_compressed(self):
+        self.save("a\n")
+        self.save("a\nb\n")
+        data, = self.db._con.execute(
+            "SELECT data FROM module_revisions WHERE kind = 'delta';"
+        ).fetchone()
+        self.assertIsInstance(data, bytes)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""Tests for migrating databases written by the original schema."""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from mts_scraper.db import Database
+from mts_scraper.scraper import Module
+
+# The tables as created before any migration existed
+BASELINE_SCHEMA = """
+CREATE TABLE programs (
+  id INTEGER PRIMARY KEY,
+  title TEXT NOT NULL,
+  degree TEXT NOT NULL
+);
+CREATE TABLE study_areas (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  title TEXT NOT NULL,
+  parent_id INTEGER,
+  program_id INTEGER NOT NULL,
+  FOREIGN KEY (program_id)
+    REFERENCES programs (id)
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE
+);
+CREATE TABLE modules (
+  id INTEGER,
+  version INTEGER,
+  title TEXT NOT NULL,
+  ects INTEGER NOT NULL,
+  exam_type TEXT NOT NULL,
+  details_fetched BOOLEAN DEFAULT FALSE,
+  faculty TEXT,
+  department TEXT,
+  learning_outcomes TEXT,
+  content TEXT,
+  PRIMARY KEY (id, version)
+);
+CREATE TABLE modules_study_areas (
+  study_area_id INTEGER,
+  module_id INTEGER,
+  module_version INTEGER,
+  PRIMARY KEY (study_area_id, module_id, module_version),
+  FOREIGN KEY (study_area_id)
+    REFERENCES study_areas (id)
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE,
+  FOREIGN KEY (module_id, module_version)
+    REFERENCES modules (id, version)
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE
+);
+CREATE TABLE module_parts (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  title TEXT NOT NULL,
+  language TEXT NOT NULL,
+  type TEXT NOT NULL,
+  turnus TEXT NOT NULL,
+  sws INTEGER NOT NULL,
+  number TEXT,
+  module_id INTEGER NOT NULL,
+  module_version INTEGER NOT NULL,
+  FOREIGN KEY (module_id, module_version)
+    REFERENCES modules (id, version)
+    ON UPDATE NO ACTION
+    ON DELETE CASCADE
+);
+"""
+
+PROGRAMS = [(1, "Informatik", "BSc")]
+# Area 2 is a subarea of area 1
+STUDY_AREAS = [
+    (1, "Pflichtbereich", None, 1),
+    (2, "Grundlagen", 1, 1),
+    (3, "Wahlbereich", None, 1),
+]
+MODULES = [
+    (10, 1, "Algorithmen", 6, "Portfolio", 1, "Fakultät IV",
+     "Informatik", "Lernergebnisse", "Lehrinhalte"),
+    (11, 2, "Analysis", 9, "Schriftliche Prüfung", 1, "Fakultät II",
+     "Mathematik", None, "Folgen\nReihen"),
+    (12, 1, "Projekt", 3, "Portfolio", 0, None, None, None, None),
+]
+MODULES_STUDY_AREAS = [(1, 10, 1), (2, 11, 2), (2, 10, 1), (3, 12, 1)]
+MODULE_PARTS = [
+    (1, "Algorithmen", "Deutsch", "VL", "WiSe", 2, "1", 10, 1),
+    (2, "Algorithmen", "Deutsch", "UE", "WiSe", 2, None, 10, 1),
+    (3, "Analysis", "Englisch", "VL", "SoSe", 4, "3", 11, 2),
+]
+
+
+class BaselineMigrationTest(unittest.TestCase):
+    """Opening a database written by the original schema."""
+
+    def setUp(self):
+        fd, self.db_file = tempfile.mkstemp(suffix=".sqlite")
+        os.close(fd)
+        con = sqlite3.connect(self.db_file)
+        with con:
+            con.executescript(BASELINE_SCHEMA)
+            for table, rows in (("programs", PROGRAMS),
+                                ("study_areas", STUDY_AREAS),
+                                ("modules", MODULES),
+                                ("modules_study_areas", MODULES_STUDY_AREAS),
+                                ("module_parts", MODULE_PARTS)):
+                placeholders = ", ".join("?" * len(rows[0]))
+                con.executemany(
+                    f"INSERT INTO {table} VALUES ({placeholders});", rows)
+        con.close()
+        self.db = Database(self.db_file)
+
+    def tearDown(self):
+        del self.db
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.db_file + suffix):
+                os.remove(self.db_file + suffix)
+
+    def query(self, sql, parameters=()):
+        return self.db._con.execute(sql, parameters).fetchall()
+
+    def test_tables_replaced_by_views(self):
+        types = dict(self.query("SELECT name, type FROM sqlite_master;"))
+        self.assertEqual(types["modules"], "view")
+        self.assertEqual(types["module_parts"], "view")
+        self.assertEqual(types["modules_base"], "table")
+        self.assertEqual(types["module_parts_base"], "table")
+
+    def test_modules_view(self):
+        self.assertEqual(self.query("SELECT * FROM modules ORDER BY id;"),
+                         MODULES)
+
+    def test_module_parts_view(self):
+        self.assertEqual(
+            self.query("SELECT * FROM module_parts ORDER BY id;"),
+            MODULE_PARTS)
+
+    def test_lookup_tables(self):
+        self.assertEqual(
+            self.query("SELECT name FROM exam_types ORDER BY name;"),
+            [("Portfolio",), ("Schriftliche Prüfung",)])
+        self.assertEqual(
+            self.query("SELECT name FROM faculties ORDER BY name;"),
+            [("Fakultät II",), ("Fakultät IV",)])
+        self.assertEqual(
+            self.query("SELECT name FROM turnuses ORDER BY name;"),
+            [("SoSe",), ("WiSe",)])
+        # Only the IDs are stored with the modules
+        self.assertEqual(
+            self.query("""\
+                SELECT E.name, F.name FROM modules_base M
+                INNER JOIN exam_types E ON E.id = M.exam_type_id
+                LEFT JOIN faculties F ON F.id = M.faculty_id
+                WHERE M.id = 11;"""),
+            [("Schriftliche Prüfung", "Fakultät II")])
+
+    def test_module_accessors(self):
+        module = Module(10, 1)
+        self.assertEqual(self.db.get_module_details(module), {
+            "faculty": "Fakultät IV",
+            "department": "Informatik",
+            "learning_outcomes": "Lernergebnisse",
+            "content": "Lehrinhalte",
+        })
+        self.assertEqual(
+            [(p.title, p.type_, p.sws, p.number)
+             for p in self.db.get_module_parts(module)],
+            [("Algorithmen", "VL", 2, "1"), ("Algorithmen", "UE", 2, None)])
+        self.assertEqual(
+            [(m.id, m.version) for m in self.db.unfetched_modules(1)],
+            [(12, 1)])
+
+    def test_resumable_areas(self):
+        # Programs and areas were only saved once complete before
+        self.assertTrue(self.db.program_complete(1))
+        self.assertEqual(
+            self.query("SELECT DISTINCT modules_fetched FROM study_areas;"),
+            [(1,)])
+
+    def test_area_closure(self):
+        self.assertEqual(
+            set(self.query("SELECT * FROM study_area_closure;")),
+            {(1, 1, 0), (2, 2, 0), (1, 2, 1), (3, 3, 0)})
+        self.assertEqual(
+            sorted((m.id, m.version)
+                   for m in self.db.get_subtree_modules(1)),
+            [(10, 1), (11, 2)])
+
+    def test_area_stats(self):
+        # Area 1 contains modules 10 and 11 (through area 2)
+        self.assertEqual(self.db.get_area_stats(1), (2, 15, 8))
+        self.assertEqual(self.db.get_area_stats(2), (2, 15, 8))
+        self.assertEqual(self.db.get_area_stats(3), (1, 3, 0))
+
+    def test_reopen(self):
+        tables = ("modules", "module_parts", "study_area_closure",
+                  "study_area_stats", "exam_types")
+        counts = [self.query(f"SELECT count(*) FROM {t};") for t in tables]
+        uuid = self.db.uuid()
+        del self.db
+        self.db = Database(self.db_file)
+        self.assertEqual(
+            [self.query(f"SELECT count(*) FROM {t};") for t in tables],
+            counts)
+        self.assertEqual(self.db.uuid(), uuid)
+        self.assertEqual(self.query("SELECT * FROM modules ORDER BY id;"),
+                         MODULES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""Tests for extracting module details from the page source."""
+
+import os
+import unittest
+
+from mts_scraper.scraper import ModulePageParser, lxml
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@unittest.skipIf(lxml is None, "lxml is not installed")
+class TextTest(unittest.TestCase):
+    """ModulePageParser._text() following Selenium's WebElement.text."""
+
+    def assertText(self, html, text):
+        element = lxml.html.fragment_fromstring(html, create_parent="div")
+        self.assertEqual(ModulePageParser()._text(element), text)
+
+    def test_whitespace(self):
+        self.assertText("<p> a \n\t b </p>", "a b")
+        self.assertText("a <b> b </b> c", "a b c")
+        self.assertText("a<!-- comment --> b", "a b")
+
+    def test_non_breaking_spaces(self):
+        # They are neither collapsed nor trimmed
+        self.assertText("<p>a&nbsp;&nbsp; b</p>", "a   b")
+        self.assertText("<p>&nbsp;a </p>", " a")
+
+    def test_line_breaks(self):
+        self.assertText("a<br>b", "a\nb")
+        self.assertText("a<br><br>b", "a\n\nb")
+        self.assertText("a<br> <br>\n b<br>", "a\n\nb")
+
+    def test_blocks(self):
+        self.assertText("a<p>b</p>c", "a\nb\nc")
+        # Empty blocks don't add blank lines
+        self.assertText("<p>a</p><p></p><div> </div><p>b</p>", "a\nb")
+        self.assertText("<ul><li>a</li><li>b <i>c</i></li></ul>", "a\nb c")
+        self.assertText("<span style='display: block'>a</span>b", "a\nb")
+        self.assertText("<div style='display:inline'>a</div>b", "ab")
+
+    def test_tables(self):
+        self.assertText(
+            "<table><tr><th>a</th><th>b</th></tr>"
+            "<tr><td>c</td><td></td><td>d </td></tr></table>",
+            "a b\nc d")
+
+    def test_hidden(self):
+        self.assertText(
+            "a<script>x</script><style>p {}</style>"
+            "<span style='display: none'>y</span><span hidden>z</span>b",
+            "ab")
+        self.assertText(
+            "<span style='visibility: hidden'>a"
+            "<span style='visibility: visible'>b</span></span>",
+            "b")
+        # Hidden blocks still end the line
+        self.assertText("a<div style='display: none'><p>b</p></div>c",
+                        "a\nc")
+
+    def test_pre(self):
+        self.assertText("<pre>a\n  b\n\nc</pre>", "a\n  b\n\nc")
+        self.assertText("<span style='white-space: pre-line'>a  b\nc</span>",
+                        "a b\nc")
+
+
+@unittest.skipIf(lxml is None, "lxml is not installed")
+class ParseTest(unittest.TestCase):
+    """ModulePageParser.parse() on a saved module page."""
+
+    def setUp(self):
+        with open(os.path.join(FIXTURES, "module_page.html"),
+                  encoding="utf-8") as f:
+            self.details, self.parts = ModulePageParser().parse(f.read())
+
+    def test_details(self):
+        self.assertEqual(self.details, {
+            "faculty": "Fakultät IV",
+            "department": "Algorithmik und Komplexität",
+            "learning_outcomes":
+                "Die Studierenden kennen grundlegende Algorithmen.\n"
+                "\n"
+                "Sie können  sie analysieren.\n"
+                "Sortieren\n"
+                "Suchen in Graphen",
+            "content": "Sortieren, Suchen\n\nGraphen:\nKürzeste Wege",
+        })
+
+    def test_parts(self):
+        self.assertEqual(
+            [(p.title, p.type_, p.number, p.turnus, p.language, p.sws)
+             for p in self.parts],
+            [("Algorithmen", "VL", "0434 L 001", "WiSe", "Deutsch", "2"),
+             ("Algorithmen\n(Übung)", "UE", "", "WiSe", "Deutsch", "2")])
+
+
+if __name__ == "__main__":
+    unittest.main()